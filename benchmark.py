@@ -0,0 +1,200 @@
+"""Scaling benchmarks for the evolution and resolution policies.
+
+Times the policies on seeded universes of increasing size, fits the scaling
+exponent k of time ~ n^k for each benchmark and writes the results as JSON.
+When given a baseline (a results file of an earlier run) it exits with a
+non-zero status if any timing regressed by more than the threshold. Run:
+
+    python benchmark.py --output results.json --baseline baseline.json
+"""
+from argparse import ArgumentParser
+from json import dump, load
+from random import seed, random
+from timeit import default_timer
+from sys import exit, version
+import numpy as np
+
+from simulate import *
+
+class Benchmark(object):
+    """A timed operation on universes of increasing size.
+
+    Attributes:
+        _name: name of the benchmark.
+        _setup: function of (n) that builds the state and returns a function
+            of no arguments running the operation once.
+        _max_size: largest n the benchmark is run for (pure Python policies
+            are quadratic, so they stop earlier).
+    """
+
+    def __init__(self, name, setup, max_size):
+        self._name = name
+        self._setup = setup
+        self._max_size = max_size
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def time(self, n, repeat, random_seed):
+        """Returns the best of "repeat" timings (in seconds) of the operation
+        on a universe of n points, rebuilding the state for each run.
+        """
+        best = None
+        for i in xrange(repeat):
+            seed(random_seed)
+            operation = self._setup(n)
+            start = default_timer()
+            operation()
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+class Benchmarks(object):
+    """The benchmark suite. See Benchmark for details.
+    """
+
+    SIZES = (10, 100, 1000, 10000, 100000)
+
+    @staticmethod
+    def all():
+        return [
+            Benchmark('EulerMethodGravityEvolution.evolve', Benchmarks.euler_evolve, 1000),
+            Benchmark('VectorizedGravityEvolution.evolve', Benchmarks.vectorized_evolve, 10000),
+            Benchmark('CompiledGravityEvolution.evolve', Benchmarks.compiled_evolve, 10000),
+            Benchmark('BarnesHutGravityEvolution.evolve', Benchmarks.barnes_hut_evolve, 100000),
+            Benchmark('MergeCollision.resolve', Benchmarks.merge_collision, 10000),
+            Benchmark('StarFormation.resolve', Benchmarks.star_formation, 100000),
+            Benchmark('Serialize', Benchmarks.serialize, 1000),
+            Benchmark('Simulator.run', Benchmarks.headless_run, 1000)]
+
+    @staticmethod
+    def random_universe(n, universe_class=Universe):
+        """Universe.random(n) with the integer positions jittered, so that no
+        two points coincide (EulerMethodGravityEvolution divides by their
+        distance).
+        """
+        universe = universe_class.random(n)
+        for point in universe.points:
+            point.position = point.position + Vector2D(random(), random())
+        return universe
+
+    @staticmethod
+    def euler_evolve(n):
+        universe = Benchmarks.random_universe(n)
+        return lambda: EulerMethodGravityEvolution().evolve(universe)
+
+    @staticmethod
+    def vectorized_evolve(n):
+        universe = Benchmarks.random_universe(n, ArrayUniverse)
+        return lambda: VectorizedGravityEvolution().evolve(universe)
+
+    @staticmethod
+    def compiled_evolve(n):
+        universe = Benchmarks.random_universe(n, ArrayUniverse)
+        return lambda: CompiledGravityEvolution().evolve(universe)
+
+    @staticmethod
+    def barnes_hut_evolve(n):
+        universe = Benchmarks.random_universe(n, ArrayUniverse)
+        return lambda: BarnesHutGravityEvolution().evolve(universe)
+
+    @staticmethod
+    def merge_collision(n):
+        universe = Universe.static_identical_planets(n)
+        return lambda: MergeCollision().resolve(universe)
+
+    @staticmethod
+    def star_formation(n):
+        universe = Universe.random(n)
+        return lambda: StarFormation().resolve(universe)
+
+    @staticmethod
+    def serialize(n):
+        simulator = Simulator([EulerMethodGravityEvolution()], [MergeCollision(), StarFormation()], Universe.random(n), Iterations(10))
+        return lambda: Serialize.decode(Serialize.encode(simulator))
+
+    @staticmethod
+    def headless_run(n):
+        simulator = Simulator([VectorizedGravityEvolution()], [MergeCollision(), StarFormation()], Benchmarks.random_universe(n, ArrayUniverse), Iterations(10), Headless())
+        return simulator.run
+
+    @staticmethod
+    def run(benchmarks, sizes, repeat=3, random_seed=0, max_size=None):
+        """Runs the benchmarks on every size up to their (and "max_size")
+        limit.
+
+        Returns:
+            dict mapping benchmark name to {"sizes", "seconds", "exponent"}.
+        """
+        results = {}
+        for benchmark in benchmarks:
+            limit = benchmark.max_size if max_size is None else min(benchmark.max_size, max_size)
+            benchmark_sizes = [n for n in sizes if n <= limit]
+            seconds = [benchmark.time(n, repeat, random_seed) for n in benchmark_sizes]
+            results[benchmark.name] = {'sizes': benchmark_sizes, 'seconds': seconds, 'exponent': Benchmarks.fit_exponent(benchmark_sizes, seconds)}
+        return results
+
+    @staticmethod
+    def fit_exponent(sizes, seconds):
+        """Returns the least squares fit of k in seconds ~ sizes^k, or None if
+        there are fewer than two sizes.
+        """
+        if len(sizes) < 2:
+            return None
+        return float(np.polyfit(np.log(sizes), np.log(np.maximum(seconds, 1e-9)), 1)[0])
+
+    @staticmethod
+    def regressions(results, baseline, threshold):
+        """Compares timings with the timings of a baseline run.
+
+        Returns:
+            List of (name, size, seconds, baseline seconds) for every timing
+            more than "threshold" (a fraction) slower than the baseline.
+        """
+        regressions = []
+        for name, result in sorted(results.items()):
+            if name not in baseline:
+                continue
+            baseline_seconds = dict(zip(baseline[name]['sizes'], baseline[name]['seconds']))
+            for n, seconds in zip(result['sizes'], result['seconds']):
+                if n in baseline_seconds and seconds > baseline_seconds[n] * (1 + threshold):
+                    regressions.append((name, n, seconds, baseline_seconds[n]))
+        return regressions
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='benchmark_results.json', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--max-size', type=int, help='largest universe size to run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timings per size, the best is kept')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random universes')
+    parser.add_argument('--only', action='append', help='run only the benchmarks with this name (repeatable)')
+    args = parser.parse_args()
+
+    benchmarks = [benchmark for benchmark in Benchmarks.all() if not args.only or benchmark.name in args.only]
+    results = Benchmarks.run(benchmarks, Benchmarks.SIZES, args.repeat, args.seed, args.max_size)
+    output = open(args.output, 'w')
+    dump({'python': version, 'numpy': np.__version__, 'seed': args.seed, 'results': results}, output, indent=2, sort_keys=True)
+    output.close()
+    for name, result in sorted(results.items()):
+        print "%-40s exponent %s  %s" % (name, "%.2f" % result['exponent'] if result['exponent'] is not None else "-",
+            "  ".join("n=%d: %.4fs" % (n, t) for n, t in zip(result['sizes'], result['seconds'])))
+
+    if args.baseline:
+        baseline_file = open(args.baseline, 'r')
+        baseline = load(baseline_file)['results']
+        baseline_file.close()
+        regressions = Benchmarks.regressions(results, baseline, args.threshold)
+        for name, n, seconds, baseline_seconds in regressions:
+            print "REGRESSION %s n=%d: %.4fs vs baseline %.4fs" % (name, n, seconds, baseline_seconds)
+        if regressions:
+            exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from simulate import * 
 
 class Examples(object):
-    """A collection of examples. See simulate.py for more details.
+    """A collection of examples. See the simulate package for more details.
     """
 
     @staticmethod
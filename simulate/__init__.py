@@ -0,0 +1,31 @@
+"""Simulates the evolution of a 2D universe of points under gravity.
+
+The package is split into the state classes (state), spatial indexes
+(spatial), the Simulator (simulator), termination conditions (termination),
+render policies (rendering), evolution policies (integrators), resolution
+policies (resolution), instrumentation, ensembles, recording and
+serialization. The public names of every module (its __all__) are
+re-exported here, so "from simulate import *" gives all of them and nothing
+else.
+
+pygame and jsonpickle are only imported once something is drawn or encoded
+with jsonpickle, so headless processes never load them.
+"""
+from .state import *
+from .spatial import *
+from .simulator import *
+from .termination import *
+from .rendering import *
+from .integrators import *
+from .resolution import *
+from .instrumentation import *
+from .ensembles import *
+from .recording import *
+from .serialization import *
+from .decomposition import *
+
+from . import (state, spatial, simulator, termination, rendering, integrators, resolution,
+    instrumentation, ensembles, recording, serialization, decomposition)
+
+__all__ = sum((module.__all__ for module in (state, spatial, simulator, termination, rendering,
+    integrators, resolution, instrumentation, ensembles, recording, serialization, decomposition)), [])
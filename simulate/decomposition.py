@@ -0,0 +1,428 @@
+from __future__ import absolute_import
+from math import sqrt, pow
+from multiprocessing import Pool, cpu_count
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from .integrators import VectorizedGravityEvolution
+from .resolution import MergeCollision, ClusterMergeCollision
+from .spatial import SpatialHash
+from .state import ArrayUniverse, Diagnostics, Universe, Point, Vector2D, ChangeFeed
+
+__all__ = ['TileLayout', 'TiledPool', 'TiledGravityEvolution', 'TiledMergeCollision']
+
+###################################
+###
+### Domain Decomposition
+###
+###################################
+
+class TileLayout(object):
+    """Splits the Universe.SIZE plane into "tiles" x "tiles" square tiles.
+    Points outside of the plane belong to the nearest edge tile.
+
+    Each step the points are sorted by tile, so the points of a tile are a
+    contiguous range of the sorted arrays and a point migrates to another
+    tile simply by being sorted into its range.
+
+    Attributes:
+        _tiles: number of tiles per side.
+        _tile_size: side length of a tile.
+    """
+
+    def __init__(self, tiles):
+        self._tiles = tiles
+        self._tile_size = float(Universe.SIZE) / tiles
+
+    @property
+    def tiles(self):
+        return self._tiles
+
+    @property
+    def tile_size(self):
+        return self._tile_size
+
+    def sort(self, positions):
+        """Returns a tuple (order, bounds): the stable order of the points by
+        tile, and the (tiles * tiles + 1,) array of the start of the range of
+        every tile in that order.
+        """
+        cells = np.clip(np.floor(positions / self._tile_size).astype(np.int64), 0, self._tiles - 1)
+        keys = cells[:, 0] * self._tiles + cells[:, 1]
+        order = np.argsort(keys, kind='mergesort')
+        bounds = np.searchsorted(keys[order], np.arange(self._tiles * self._tiles + 1))
+        return order, bounds
+
+    def neighbours(self, tile):
+        """Returns the tiles adjacent to "tile", including itself, in
+        increasing order.
+        """
+        column, row = divmod(tile, self._tiles)
+        return [c * self._tiles + r
+            for c in xrange(max(column - 1, 0), min(column + 2, self._tiles))
+            for r in xrange(max(row - 1, 0), min(row + 2, self._tiles))]
+
+class TiledPool(object):
+    """Worker pool sharing a (capacity, columns) float array with its workers,
+    for the tiled policies. The pool is started on the first use and
+    restarted with twice the capacity when the points do not fit. The tiled
+    policies close it in their close(), which Simulator.run calls when the
+    run ends or fails.
+
+    Attributes:
+        _processes: number of worker processes.
+        _columns: number of columns of the shared array.
+        _pool: the worker pool.
+        _capacity: number of rows of the shared array.
+        _array: the shared array.
+    """
+
+    def __init__(self, processes, columns):
+        self._processes = processes
+        self._columns = columns
+        self._pool = None
+        self._capacity = 0
+        self._array = None
+
+    def array(self, count):
+        """Returns the first "count" rows of the shared array."""
+        if self._pool is None or count > self._capacity:
+            self.close()
+            self._capacity = max(count, 2 * self._capacity)
+            buffer = RawArray('d', self._capacity * self._columns)
+            self._array = np.frombuffer(buffer).reshape(self._capacity, self._columns)
+            self._pool = Pool(self._processes, _init_tiled_worker, (buffer, self._capacity, self._columns))
+        return self._array[:count]
+
+    def map(self, function, tasks):
+        return self._pool.map(function, tasks)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+class TiledGravityEvolution(object):
+    """Uses Euler's Method to evolve points in a universe via gravity, with
+    the plane split into tiles (see TileLayout) whose accelerations are
+    computed by a pool of worker processes.
+
+    The worker of a tile sums the forces of the points of its tile and of the
+    adjacent tiles (the ghosts) exactly, and approximates every other tile by
+    a point mass at its center of mass (its far field summary). The sorted
+    positions and masses are shared with the workers, so each step only the
+    tile ranges and the summaries are sent. The cost per tile is the number
+    of points of its neighbourhood times the number of points in the tile,
+    instead of the number of points squared.
+
+    Attributes:
+        _t: evolution step size.
+        _tiles: number of tiles per side, 1 computes every force exactly.
+        _processes: number of worker processes, by default the number of CPUs.
+        _diagnostics: whether to compute the Diagnostics of the universe
+            (at the start of each step) during the force pass, with the
+            potentials approximated like the accelerations.
+        _pool: TiledPool with (x, y, mass, acceleration x, acceleration y,
+            potential) columns (not serialized).
+    """
+
+    def __init__(self, t=1, tiles=4, processes=None, diagnostics=False):
+        self._t = t
+        self._tiles = tiles
+        self._processes = processes if processes is not None else cpu_count()
+        self._diagnostics = diagnostics
+        self._pool = None
+        self._interactions = 0
+
+    def __getstate__(self):
+        return {'_t': self._t, '_tiles': self._tiles, '_processes': self._processes, '_diagnostics': self._diagnostics}
+
+    def __setstate__(self, state):
+        self._diagnostics = False
+        self.__dict__.update(state)
+        self._pool = None
+        self._interactions = 0
+
+    @property
+    def interactions(self):
+        """Number of pairwise and point to tile force terms evaluated by the
+        last step.
+        """
+        return self._interactions
+
+    def compute_gravity_accelerations(self, positions, masses, potentials=None):
+        """Returns the (n, 2) array of the approximate accelerations of the
+        points, and writes their approximate potentials to "potentials" if
+        given.
+        """
+        count = len(positions)
+        layout = TileLayout(self._tiles)
+        order, bounds = layout.sort(positions)
+        if self._pool is None:
+            self._pool = TiledPool(self._processes, 6)
+        shared = self._pool.array(count)
+        shared[:, 0:2] = positions[order]
+        shared[:, 2] = masses[order]
+        tile_count = self._tiles * self._tiles
+        keys = np.repeat(np.arange(tile_count), np.diff(bounds))
+        tile_masses = np.bincount(keys, weights=shared[:, 2], minlength=tile_count)
+        centers = np.zeros((tile_count, 2))
+        occupied = tile_masses > 0
+        for axis in (0, 1):
+            centers[occupied, axis] = np.bincount(keys, weights=shared[:, axis] * shared[:, 2], minlength=tile_count)[occupied] / tile_masses[occupied]
+        tasks = []
+        self._interactions = 0
+        for tile in xrange(tile_count):
+            start, stop = bounds[tile], bounds[tile + 1]
+            if start == stop:
+                continue
+            neighbours = layout.neighbours(tile)
+            near = [(bounds[other], bounds[other + 1]) for other in neighbours]
+            far = [other for other in xrange(tile_count) if occupied[other] and other not in neighbours]
+            tasks.append((start, stop, near, tile_masses[far], centers[far], potentials is not None))
+            self._interactions += (stop - start) * (sum(high - low for low, high in near) - 1 + len(far))
+        self._pool.map(_compute_tile_gravity, tasks)
+        accelerations = np.empty((count, 2))
+        accelerations[order] = shared[:, 3:5]
+        if potentials is not None:
+            potentials[order] = shared[:, 5]
+        return accelerations
+
+    def evolve(self, universe):
+        """Applies Euler's Method (to second derivative) to evolve the points
+        in the provided universe.
+
+        Args:
+            universe: The universe to evolve.
+
+        Mutates:
+            universe: Positions and velocities are advanced by one time step,
+                x(t) = x(t_0) + v(t_0) * t + (a(t_0) * t^2) / 2.
+        """
+        positions, velocities, masses = universe.kinematics()
+        if not len(positions):
+            return
+        potentials = np.empty(len(positions)) if self._diagnostics else None
+        acceleration = self.compute_gravity_accelerations(positions, masses, potentials)
+        if self._diagnostics:
+            universe.diagnostics = Diagnostics.from_arrays(positions, velocities, masses, potentials)
+        positions += velocities * self._t + acceleration * (pow(self._t, 2) / 2.0)
+        velocities += acceleration * self._t
+        universe.set_kinematics(positions, velocities)
+
+    def close(self):
+        """Stops the worker pool. It is restarted by the next step."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def __repr__(self):
+        return "\nTiledGravityEvolution(t=%r, tiles=%r, processes=%r, diagnostics=%r)" % (self._t, self._tiles, self._processes, self._diagnostics)
+
+class TiledMergeCollision(object):
+    """Merges points in a universe when they collide, with the same result as
+    MergeCollision, with the plane split into tiles (see TileLayout) whose
+    collisions are found and resolved by a pool of worker processes.
+
+    1) The worker of a tile tests the points of its tile against the points
+       of its tile and of the adjacent tiles (the ghosts), which holds every
+       overlapping pair as long as tiles are wider than the largest diameter.
+       Otherwise a single MergeCollision resolves the universe.
+    2) The overlapping pairs are grouped into connected components, and a
+       component grows by every point closer to its bounding box than the
+       radius a merge of all of its points could reach, until no two
+       components can touch. A group is then independent of the rest of the
+       universe: MergeCollision merges the same pairs in the same order
+       whether it runs on the group or on all points.
+    3) The workers run MergeCollision on the groups, whose results are copied
+       back and whose merges are published on the change feed.
+
+    Steps without collisions end after 1).
+
+    Attributes:
+        _tiles: number of tiles per side.
+        _processes: number of worker processes, by default the number of CPUs.
+        _pool: TiledPool with (x, y, radius) columns (not serialized).
+        _interactions: Number of pairs tested by the last resolve.
+    """
+
+    def __init__(self, tiles=4, processes=None):
+        self._tiles = tiles
+        self._processes = processes if processes is not None else cpu_count()
+        self._pool = None
+        self._interactions = 0
+
+    def __getstate__(self):
+        return {'_tiles': self._tiles, '_processes': self._processes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = None
+        self._interactions = 0
+
+    @property
+    def interactions(self):
+        return self._interactions
+
+    def overlapping_pairs(self, positions, radii):
+        """Returns the (i, j) index arrays of the overlapping pairs, i < j."""
+        count = len(positions)
+        layout = TileLayout(self._tiles)
+        order, bounds = layout.sort(positions)
+        if self._pool is None:
+            self._pool = TiledPool(self._processes, 3)
+        shared = self._pool.array(count)
+        shared[:, 0:2] = positions[order]
+        shared[:, 2] = radii[order]
+        tasks = []
+        for tile in xrange(self._tiles * self._tiles):
+            if bounds[tile] < bounds[tile + 1]:
+                near = [(bounds[other], bounds[other + 1]) for other in layout.neighbours(tile)]
+                tasks.append((bounds[tile], bounds[tile + 1], near, max(2 * float(radii.max()), 1)))
+        first, second, tested = [], [], 0
+        for i, j, tile_tested in self._pool.map(_find_tile_overlaps, tasks):
+            first.append(i)
+            second.append(j)
+            tested += tile_tested
+        self._interactions = tested
+        i, j = order[np.concatenate(first)], order[np.concatenate(second)]
+        return np.minimum(i, j), np.maximum(i, j)
+
+    @staticmethod
+    def independent_groups(positions, radii, i, j):
+        """Returns the groups of indices that MergeCollision can resolve
+        independently of each other and of the other points, each sorted.
+        """
+        count = len(positions)
+        pairs = zip(i.tolist(), j.tolist())
+        # Candidates of a group are looked up in the window of x around it.
+        order = np.argsort(positions[:, 0], kind='mergesort')
+        xs = positions[order, 0]
+        max_radius = radii.max()
+        while True:
+            groups = ClusterMergeCollision.components(count, pairs)
+            grown = []
+            for group in groups:
+                members = np.array(group)
+                low = positions[members].min(axis=0)
+                high = positions[members].max(axis=0)
+                # A merge of the group lies within its bounding box and its
+                # radius is at most the radius of the total area.
+                reach = sqrt(np.dot(radii[members], radii[members]))
+                window = order[np.searchsorted(xs, low[0] - reach - max_radius, 'left'):np.searchsorted(xs, high[0] + reach + max_radius, 'right')]
+                gap = np.maximum(np.maximum(low - positions[window], positions[window] - high), 0)
+                touching = window[np.einsum('ij,ij->i', gap, gap) <= (reach + radii[window]) ** 2]
+                inside = set(group)
+                grown.extend((group[0], other) for other in touching.tolist() if other not in inside)
+            if not grown:
+                return groups
+            pairs.extend(grown)
+
+    def resolve(self, universe):
+        """Merges the points closer than their combined radii like
+        MergeCollision.resolve.
+
+        Args:
+            universe: The universe to revolve.
+
+        Mutates:
+            universe: For each collision one point is removed and the other
+            point is mutated such that momentum is conserved, mass is
+            conserved, and the area of the remaining point equals the area of
+            the original two points.
+        """
+        points = list(universe.points)
+        self._interactions = 0
+        if len(points) < 2:
+            return
+        arrays = universe if isinstance(universe, ArrayUniverse) else ArrayUniverse(points)
+        positions, radii = arrays.positions, arrays.radii.astype(float)
+        if 2 * radii.max() > TileLayout(self._tiles).tile_size:
+            collision = MergeCollision()
+            collision.resolve(universe)
+            self._interactions = collision.interactions
+            return
+        i, j = self.overlapping_pairs(positions, radii)
+        if not len(i):
+            return
+        tasks = [(group, positions[group], arrays.velocities[group], arrays.masses[group], arrays.radii[group], arrays.stars[group])
+            for group in TiledMergeCollision.independent_groups(positions, radii, i, j)]
+        removed = []
+        for merged, merges in self._pool.map(_resolve_tile_group, tasks):
+            for index, position, velocity, mass, radius in merged:
+                point = points[index]
+                point.position = Vector2D(*position)
+                point.velocity = Vector2D(*velocity)
+                point.mass = mass
+                point.radius = radius
+            for survivor, absorbed in merges:
+                universe.changes.publish(ChangeFeed.MERGED, points[survivor], points[absorbed])
+                removed.append(absorbed)
+        universe.remove_points([points[index] for index in sorted(removed)])
+
+    def close(self):
+        """Stops the worker pool. It is restarted by the next step."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def __repr__(self):
+        return "\nTiledMergeCollision(tiles=%r, processes=%r)" % (self._tiles, self._processes)
+
+# Shared array of a TiledPool worker process.
+_tiled_array = None
+
+def _init_tiled_worker(buffer, capacity, columns):
+    global _tiled_array
+    _tiled_array = np.frombuffer(buffer).reshape(capacity, columns)
+
+def _gather(ranges, columns):
+    return np.concatenate([_tiled_array[low:high, columns] for low, high in ranges])
+
+def _compute_tile_gravity(task):
+    start, stop, near, far_masses, far_centers, with_potentials = task
+    positions = _gather(near, slice(0, 2))
+    masses = _gather(near, 2)
+    offset = 0
+    for low, high in near:
+        if low == start:
+            break
+        offset += high - low
+    potentials = np.empty(stop - start) if with_potentials else None
+    accelerations = VectorizedGravityEvolution.compute_gravity_accelerations(positions, masses, start=offset, stop=offset + stop - start, potentials=potentials)
+    if len(far_masses):
+        diff = far_centers[np.newaxis, :, :] - positions[offset:offset + stop - start, np.newaxis, :]
+        r_squared = np.einsum('ijk,ijk->ij', diff, diff)
+        weights = far_masses[np.newaxis, :] * r_squared ** -1.5
+        accelerations += np.einsum('ij,ijk->ik', weights, diff)
+        if with_potentials:
+            potentials -= np.einsum('ij,ij->i', weights, r_squared)
+    _tiled_array[start:stop, 3:5] = accelerations
+    if with_potentials:
+        _tiled_array[start:stop, 5] = potentials
+
+def _find_tile_overlaps(task):
+    start, stop, near, distance = task
+    positions = _gather(near, slice(0, 2))
+    radii = _gather(near, 2)
+    indices = np.concatenate([np.arange(low, high) for low, high in near])
+    i, j = SpatialHash.pairs_within(positions, distance)
+    # Each pair is reported by the tile of its first point.
+    own = (indices[i] >= start) & (indices[i] < stop) & (indices[i] < indices[j])
+    i, j = i[own], j[own]
+    diff = positions[i] - positions[j]
+    # The same test as MergeCollision, so that both agree on the boundary.
+    overlapping = np.sqrt(np.einsum('ij,ij->i', diff, diff)) < radii[i] + radii[j]
+    return indices[i[overlapping]], indices[j[overlapping]], len(i)
+
+def _resolve_tile_group(task):
+    group, positions, velocities, masses, radii, stars = task
+    universe = Universe([Point(Vector2D(*position), Vector2D(*velocity), mass, radius, star)
+        for position, velocity, mass, radius, star in zip(positions.tolist(), velocities.tolist(), masses.tolist(), radii.tolist(), stars.tolist())])
+    points = list(universe.points)
+    subscription = universe.changes.subscribe()
+    MergeCollision().resolve(universe)
+    merges = [(points.index(survivor), points.index(absorbed)) for kind, survivor, absorbed in universe.changes.read(subscription) if kind == ChangeFeed.MERGED]
+    survivors = sorted(set(survivor for survivor, absorbed in merges) - set(absorbed for survivor, absorbed in merges))
+    merged = [(group[k], points[k].position.tuple, points[k].velocity.tuple, points[k].mass, points[k].radius) for k in survivors]
+    return merged, [(group[survivor], group[absorbed]) for survivor, absorbed in merges]
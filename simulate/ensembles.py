@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+from random import seed
+from math import pow
+from itertools import product
+from csv import DictWriter
+from timeit import default_timer
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from .integrators import VectorizedGravityEvolution
+from .rendering import Headless
+from .resolution import MergeCollision, StarFormation
+from .simulator import Simulator
+from .state import ArrayUniverse
+from .termination import Iterations
+
+__all__ = ['Ensemble']
+
+###################################
+###
+### Ensembles
+###
+###################################
+
+class Ensemble(object):
+    """Runs a headless simulation for every combination of the values of a
+    parameter grid, across a process pool, and collects a summary row for
+    each run.
+
+    By default (see Ensemble.build) the parameters are "n" (number of points
+    of a Universe.random), "seed", "t" (evolution step size),
+    "threshold_mass" of the StarFormation and "iterations". The random
+    generators are seeded with "seed" before a simulator is built, so runs
+    are reproducible. Runs are handed out one at a time, longest expected
+    (n^2 * iterations) first, so a worker that finishes early takes the next
+    run instead of waiting on a fixed share.
+
+    Attributes:
+        _grid: dict mapping parameter name to the list of its values.
+        _processes: number of worker processes, by default the number of CPUs.
+        _build: module level function of (parameters) returning a Simulator,
+            or None for Ensemble.build.
+    """
+
+    DEFAULTS = {'n': 10, 'seed': 0, 't': 1, 'threshold_mass': 500, 'iterations': 1000}
+
+    def __init__(self, grid, processes=None, build=None):
+        self._grid = grid
+        self._processes = processes if processes is not None else cpu_count()
+        self._build = build
+
+    def parameters(self):
+        """Returns the list of parameter dicts, one per combination."""
+        names = sorted(self._grid)
+        combinations = []
+        for values in product(*[self._grid[name] for name in names]):
+            parameters = dict(Ensemble.DEFAULTS)
+            parameters.update(zip(names, values))
+            combinations.append(parameters)
+        return combinations
+
+    @staticmethod
+    def build(parameters):
+        """Builds the default ensemble member, a headless simulation of a
+        random universe with gravity, merges and star formation.
+        """
+        universe = ArrayUniverse.random(parameters['n'])
+        return Simulator([VectorizedGravityEvolution(parameters['t'])], [MergeCollision(), StarFormation(parameters['threshold_mass'])], universe, Iterations(parameters['iterations']), Headless())
+
+    @staticmethod
+    def run_member(parameters, build=None):
+        """Seeds the random generators, builds and runs one simulation.
+
+        Returns:
+            The parameters extended with the final number of "bodies" and
+            "stars", the total "energy" and the wall time in "seconds".
+        """
+        seed(parameters['seed'])
+        np.random.seed(parameters['seed'])
+        simulator = (build or Ensemble.build)(parameters)
+        started = default_timer()
+        simulator.run()
+        universe = simulator.universe
+        row = dict(parameters)
+        row['bodies'] = len(universe.points)
+        row['stars'] = sum(1 for point in universe.points if point.star)
+        row['energy'] = universe.energy()
+        row['seconds'] = default_timer() - started
+        return row
+
+    def run(self):
+        """Runs every combination of parameters on the process pool.
+
+        Returns:
+            List of summary rows (see run_member), in the order of
+            parameters().
+        """
+        combinations = self.parameters()
+        tasks = [(index, parameters, self._build) for index, parameters in enumerate(combinations)]
+        tasks.sort(key=lambda task: -pow(task[1]['n'], 2) * task[1]['iterations'])
+        rows = [None] * len(tasks)
+        pool = Pool(self._processes)
+        try:
+            for index, row in pool.imap_unordered(_run_ensemble_task, tasks, chunksize=1):
+                rows[index] = row
+        except BaseException:
+            # A failed member or an interrupt should not wait for the runs
+            # still queued.
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        return rows
+
+    @staticmethod
+    def to_csv(rows, filename):
+        """Writes summary rows to a CSV file with one column per key."""
+        columns = sorted(set(key for row in rows for key in row))
+        with open(filename, 'wb') as csv_file:
+            writer = DictWriter(csv_file, columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def __repr__(self):
+        return "\nEnsemble(%r, processes=%r)" % (self._grid, self._processes)
+
+def _run_ensemble_task(task):
+    index, parameters, build = task
+    return index, Ensemble.run_member(parameters, build)
@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+from json import dumps
+from timeit import default_timer
+
+__all__ = ['Profiler', 'SimulationStats']
+
+###################################
+###
+### Instrumentation
+###
+###################################
+
+class Profiler(object):
+    """Records, for every iteration of a Simulator, the wall time of each phase
+    (evolution policy, resolution policy and draw call, by class name), the
+    pair interactions evaluated, the merges performed and the body count, plus
+    the total energy when an evolution policy computes diagnostics and the
+    steps per level of BlockTimestepGravityEvolution.
+
+    The statistics are available in process as a SimulationStats and, if a
+    summary file is given, a JSON line with the summary of the statistics so
+    far is appended to it every "summary_every" iterations and when the
+    simulation ends.
+
+    Attributes:
+        _stats: The SimulationStats being recorded.
+        _summary_filename: File the summaries are appended to, or None.
+        _summary_every: Number of iterations between summaries.
+        _record: Record of the current iteration.
+        _phase_start: (start time, body count) of the current phase.
+    """
+
+    def __init__(self, summary_filename=None, summary_every=100):
+        self._stats = SimulationStats()
+        self._summary_filename = summary_filename
+        self._summary_every = summary_every
+        self._record = None
+        self._phase_start = None
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def start_iteration(self, iteration, universe):
+        self._record = {'iteration': iteration, 'phases': {}, 'interactions': 0, 'merges': 0, 'bodies': len(universe.points)}
+
+    def start_phase(self, universe):
+        self._phase_start = (default_timer(), len(universe.points))
+
+    def end_phase(self, name, policy, universe):
+        started, bodies = self._phase_start
+        phases = self._record['phases']
+        phases[name] = phases.get(name, 0.0) + default_timer() - started
+        self._record['interactions'] += getattr(policy, 'interactions', 0)
+        self._record['merges'] += bodies - len(universe.points)
+        if hasattr(policy, 'level_counts'):
+            self._record['levels'] = list(policy.level_counts)
+
+    def end_iteration(self, universe):
+        self._record['bodies'] = len(universe.points)
+        if universe.diagnostics is not None:
+            self._record['energy'] = universe.diagnostics.energy
+        self._stats.add(self._record)
+        if self._summary_filename is not None and len(self._stats) % self._summary_every == 0:
+            self.write_summary()
+
+    def write_summary(self):
+        with open(self._summary_filename, 'a') as summary_file:
+            summary_file.write(dumps(self._stats.summary(), sort_keys=True) + '\n')
+
+    def close(self):
+        if self._summary_filename is not None and len(self._stats) % self._summary_every:
+            self.write_summary()
+
+    def __repr__(self):
+        return "\nProfiler(%r, summary_every=%r)" % (self._summary_filename, self._summary_every)
+
+class SimulationStats(object):
+    """Per iteration statistics recorded by a Profiler.
+
+    Attributes:
+        _records: List with one dict per iteration holding the "iteration",
+            the seconds spent in each of the "phases", the pair
+            "interactions" evaluated, the "merges" performed and the number of
+            "bodies" at the end of the iteration, plus the "energy" and the
+            steps per "levels" when recorded.
+    """
+
+    def __init__(self):
+        self._records = []
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def records(self):
+        return self._records
+
+    def add(self, record):
+        self._records.append(record)
+
+    def phase_seconds(self):
+        """Returns a dict mapping phase name to its total wall time."""
+        totals = {}
+        for record in self._records:
+            for name, seconds in record['phases'].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def summary(self):
+        """Returns the totals of the statistics as a JSON compatible dict."""
+        return {
+            'iterations': len(self._records),
+            'last_iteration': self._records[-1]['iteration'] if self._records else 0,
+            'phase_seconds': self.phase_seconds(),
+            'interactions': sum(record['interactions'] for record in self._records),
+            'merges': sum(record['merges'] for record in self._records),
+            'bodies': self._records[-1]['bodies'] if self._records else None}
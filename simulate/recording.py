@@ -0,0 +1,394 @@
+from __future__ import absolute_import
+from glob import glob
+from os import remove, rename
+from os.path import getsize, exists, join
+from threading import Thread
+from timeit import default_timer
+from Queue import Queue, Empty
+import numpy as np
+from .rendering import RenderCadence, SpriteRenderer
+from .serialization import MappedSnapshot, Serialize
+from .state import ArrayUniverse, Universe
+
+__all__ = ['TrajectoryRecorder', 'FrameExporter', 'Checkpointer', 'Replay']
+
+###################################
+###
+### Recording
+###
+###################################
+
+class TrajectoryRecorder(object):
+    """Observer that appends the state of the universe after every "every"
+    iterations to an append-only trajectory file, see Replay.
+
+    A record holds the positions, velocities, masses, radii and star flags of
+    the points at one step, in that order and padded to 8 bytes, so that the
+    number of points can change between records. "filename".index holds an
+    int64 (step, offset, count) row per record. Records are buffered and
+    written "chunk_steps" at a time, data before index, so the index never
+    refers to unwritten data.
+
+    A new recording truncates existing files. With "append", the existing
+    records from the first recorded step on are dropped instead, ex. to
+    continue a trajectory after Simulator.resume, so that the steps of the
+    index keep increasing.
+
+    Attributes:
+        _filename: Path of the data file.
+        _every: Number of iterations between records.
+        _chunk_steps: Number of records buffered before they are written.
+        _append: Whether the existing records before the first recorded step
+            are kept.
+        _started: Whether the files have been truncated for this recording.
+        _data: Buffered record bytes.
+        _index: Buffered index rows.
+        _offset: Offset of the next record in the data file.
+    """
+
+    RECORD_DTYPES = (('positions', '<f8'), ('velocities', '<f8'), ('masses', '<f8'), ('radii', '<i8'), ('stars', '|b1'))
+
+    def __init__(self, filename, every=1, chunk_steps=64, append=False):
+        self._filename = filename
+        self._every = every
+        self._chunk_steps = chunk_steps
+        self._append = append
+        self._started = False
+        self._data = []
+        self._index = []
+        self._offset = 0
+
+    @staticmethod
+    def index_filename(filename):
+        return filename + '.index'
+
+    def _start(self, step):
+        """Truncates the files to the records before "step", or to nothing
+        unless appending.
+        """
+        index_filename = TrajectoryRecorder.index_filename(self._filename)
+        rows = 0
+        if self._append and exists(index_filename) and getsize(index_filename):
+            steps = np.fromfile(index_filename, dtype='<i8').reshape(-1, 3)
+            rows = int(np.searchsorted(steps[:, 0], step))
+            self._offset = int(steps[rows, 1]) if rows < len(steps) else getsize(self._filename)
+        for name, size in ((self._filename, self._offset), (index_filename, rows * 3 * 8)):
+            with open(name, 'r+b' if exists(name) else 'wb') as truncated:
+                truncated.truncate(size)
+        self._started = True
+
+    def observe(self, iteration, universe):
+        if iteration % self._every:
+            return
+        if not self._started:
+            self._start(iteration)
+        arrays = universe if isinstance(universe, ArrayUniverse) else ArrayUniverse(universe.points)
+        record = b''.join(np.ascontiguousarray(getattr(arrays, name), dtype=dtype).tobytes() for name, dtype in self.RECORD_DTYPES)
+        record += b'\0' * (-len(record) % 8)
+        self._index.append((iteration, self._offset, len(arrays.points)))
+        self._data.append(record)
+        self._offset += len(record)
+        if len(self._index) >= self._chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered records to the files."""
+        if not self._index:
+            return
+        with open(self._filename, 'ab') as data_file:
+            data_file.write(b''.join(self._data))
+        with open(TrajectoryRecorder.index_filename(self._filename), 'ab') as index_file:
+            index_file.write(np.array(self._index, dtype='<i8').tobytes())
+        self._data = []
+        self._index = []
+
+    def close(self):
+        self.flush()
+
+    def __repr__(self):
+        return "\nTrajectoryRecorder(%r, every=%r, chunk_steps=%r, append=%r)" % (self._filename, self._every, self._chunk_steps, self._append)
+
+class FrameExporter(object):
+    """Observer that renders the universe offscreen after every "every"
+    iterations and writes the frames as a numbered PNG sequence or as a raw
+    RGB stream, ex. to make a video without a display and faster than real
+    time.
+
+    The simulation only queues an immutable Frame, a writer thread renders the
+    frames with a SpriteRenderer into an offscreen surface and writes them in
+    batches of up to "batch_size", so that the physics never waits on the
+    disk. The queue is unbounded, no frame is dropped.
+
+    PNG frames are written to "target" % n for n = 0, 1, 2, ... (ex.
+    'frames/%06d.png'). RGB frames are SIZE * SIZE * 3 bytes, row by row,
+    written to "target", a filename or a writable file object such as the
+    stdin of an encoder:
+
+        ffmpeg -f rawvideo -pix_fmt rgb24 -s 640x640 -r 30 -i - video.mp4
+
+    Attributes:
+        _target: Filename pattern, filename or file object written to.
+        _every: Number of iterations between frames.
+        _format: FrameExporter.PNG or FrameExporter.RGB.
+        _batch_size: Maximum number of frames written at once.
+        _density_threshold: Number of points above which a density map is
+            drawn, see SpriteRenderer.
+        _queue: Queue of frames, None tells the writer thread to stop.
+        _thread: The writer thread, started by the first frame.
+        _written: Number of frames written.
+        _error: Exception raised by the writer thread, raised again by the
+            next observe or close.
+    """
+
+    PNG = 'png'
+    RGB = 'rgb'
+
+    def __init__(self, target, every=1, format=PNG, batch_size=16, density_threshold=Universe.DENSITY_THRESHOLD):
+        if format not in (FrameExporter.PNG, FrameExporter.RGB):
+            raise ValueError("Unknown frame format %r" % (format,))
+        self._target = target
+        self._every = every
+        self._format = format
+        self._batch_size = batch_size
+        self._density_threshold = density_threshold
+        self._queue = Queue()
+        self._thread = None
+        self._written = 0
+        self._error = None
+
+    @property
+    def written(self):
+        return self._written
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def observe(self, iteration, universe):
+        if iteration % self._every:
+            return
+        self._raise_error()
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='FrameExporter')
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(universe.frame())
+
+    def _run(self):
+        from pygame import Surface, image
+        surface = Surface((Universe.SIZE, Universe.SIZE))
+        renderer = SpriteRenderer(self._density_threshold)
+        stream = None
+        if self._format == FrameExporter.RGB:
+            stream = open(self._target, 'wb') if isinstance(self._target, basestring) else self._target
+        stopping = False
+        try:
+            while not stopping:
+                batch = [self._queue.get()]
+                try:
+                    while len(batch) < self._batch_size:
+                        batch.append(self._queue.get_nowait())
+                except Empty:
+                    pass
+                if None in batch:
+                    batch = batch[:batch.index(None)]
+                    stopping = True
+                chunks = []
+                for frame in batch:
+                    renderer.draw(surface, frame)
+                    if stream is None:
+                        image.save(surface, self._target % self._written)
+                    else:
+                        chunks.append(image.tostring(surface, 'RGB'))
+                    self._written += 1
+                if chunks:
+                    stream.write(b''.join(chunks))
+                    stream.flush()
+        except Exception as error:
+            self._error = error
+        finally:
+            if stream is not None and stream is not self._target:
+                stream.close()
+
+    def close(self):
+        """Waits until every queued frame is written."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def __repr__(self):
+        return "\nFrameExporter(%r, every=%r, format=%r, batch_size=%r)" % (self._target, self._every, self._format, self._batch_size)
+
+class Checkpointer(object):
+    """Takes a checkpoint of a Simulator after every "every" iterations
+    and/or once "seconds" have passed since the last one, to continue it with
+    Simulator.resume after a crash.
+
+    A checkpoint is a binary snapshot (see Serialize) of the simulator with
+    the state of the random generators. The simulation only copies the arrays
+    and the JSON header, a writer thread writes the file. At most one
+    checkpoint waits for the writer, the simulation waits if the disk falls
+    further behind. Files are written under a temporary name and renamed, so
+    a checkpoint on disk is always complete, and only the "keep" latest are
+    kept.
+
+    Checkpoints are written to "directory"/checkpoint-<iteration>.gsim.
+
+    Attributes:
+        _directory: Directory the checkpoints are written to.
+        _every: Number of iterations between checkpoints, or None.
+        _seconds: Number of seconds between checkpoints, or None.
+        _keep: Number of checkpoints kept.
+        _last: default_timer() of the last checkpoint.
+        _queue: Queue of (filename, header, arrays), None tells the writer
+            thread to stop.
+        _thread: The writer thread, started by the first checkpoint.
+        _written: List of the filenames written.
+        _error: Exception raised by the writer thread, raised again by the
+            next observe or close.
+    """
+
+    FILENAME = 'checkpoint-%012d.gsim'
+
+    def __init__(self, directory, every=None, seconds=None, keep=3):
+        if every is None and seconds is None:
+            raise ValueError("Checkpointer needs every or seconds")
+        if keep < 1:
+            raise ValueError("Checkpointer has to keep at least one checkpoint, not %r" % (keep,))
+        self._directory = directory
+        self._every = every
+        self._seconds = seconds
+        self._keep = keep
+        self._last = default_timer()
+        self._queue = Queue(1)
+        self._thread = None
+        self._written = []
+        self._error = None
+
+    @property
+    def written(self):
+        return self._written
+
+    @staticmethod
+    def checkpoints(directory):
+        """Returns the checkpoint files in "directory", oldest first."""
+        return sorted(glob(join(directory, 'checkpoint-*.gsim')))
+
+    @staticmethod
+    def latest(directory):
+        """Returns the latest checkpoint file in "directory", or None."""
+        checkpoints = Checkpointer.checkpoints(directory)
+        return checkpoints[-1] if checkpoints else None
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def observe(self, simulator):
+        iteration = simulator.iteration
+        due = self._every is not None and iteration % self._every == 0
+        if self._seconds is not None and default_timer() - self._last >= self._seconds:
+            due = True
+        if not due:
+            return
+        self._raise_error()
+        self._last = default_timer()
+        header, arrays = Serialize.snapshot_parts(simulator)
+        header['random'] = Serialize.random_state()
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='Checkpointer')
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((join(self._directory, Checkpointer.FILENAME % iteration), header, arrays))
+
+    def _run(self):
+        while True:
+            checkpoint = self._queue.get()
+            if checkpoint is None:
+                return
+            if self._error is not None:
+                continue
+            filename, header, arrays = checkpoint
+            try:
+                Serialize.write_snapshot(header, arrays, filename + '.tmp')
+                rename(filename + '.tmp', filename)
+                self._written.append(filename)
+                checkpoints = Checkpointer.checkpoints(self._directory)
+                for old in checkpoints[:max(len(checkpoints) - self._keep, 0)]:
+                    remove(old)
+            except Exception as error:
+                self._error = error
+
+    def close(self):
+        """Waits until every checkpoint is written."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def __repr__(self):
+        return "\nCheckpointer(%r, every=%r, seconds=%r, keep=%r)" % (self._directory, self._every, self._seconds, self._keep)
+
+class Replay(object):
+    """Seekable read access to a trajectory written by a TrajectoryRecorder.
+    Both files are memory mapped, so seeking to a step reads only that record
+    and no physics is recomputed. The steps of the index must strictly
+    increase, otherwise a ValueError is raised.
+
+    Attributes:
+        _index: (records, 3) int64 array of (step, offset, count) rows.
+        _data: Memory mapped data file.
+    """
+
+    def __init__(self, filename):
+        index_filename = TrajectoryRecorder.index_filename(filename)
+        if getsize(index_filename):
+            self._index = np.memmap(index_filename, dtype='<i8', mode='r').reshape(-1, 3)
+            self._data = np.memmap(filename, dtype=np.uint8, mode='r')
+            if np.any(np.diff(self._index[:, 0]) <= 0):
+                raise ValueError("The steps of %s do not increase" % index_filename)
+        else:
+            self._index = np.empty((0, 3), dtype='<i8')
+            self._data = None
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def steps(self):
+        return self._index[:, 0]
+
+    def state(self, step):
+        """Returns the state recorded at "step" as a MappedSnapshot, whose
+        arrays are views of the memory mapped file.
+        """
+        row = np.searchsorted(self.steps, step)
+        if row == len(self._index) or self._index[row, 0] != step:
+            raise KeyError("Step %d was not recorded" % step)
+        _, offset, count = self._index[row].tolist()
+        arrays = {}
+        for name, dtype in TrajectoryRecorder.RECORD_DTYPES:
+            shape = (count, 2) if name in ('positions', 'velocities') else (count,)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            arrays[name] = self._data[offset:offset + size].view(dtype).reshape(shape)
+            offset += size
+        return MappedSnapshot({'step': step, 'count': count}, arrays)
+
+    def play(self, start=None, stop=None, render_policy=None):
+        """Draws the recorded steps in [start, stop) with the universe drawing
+        logic, every frame the render policy asks for.
+        """
+        render_policy = render_policy if render_policy is not None else RenderCadence()
+        universe = ArrayUniverse([])
+        for step in self.steps.tolist():
+            if (start is not None and step < start) or (stop is not None and step >= stop):
+                continue
+            if render_policy.should_render(step):
+                state = self.state(step)
+                universe._set_arrays(state.positions, state.velocities, state.masses, state.radii, state.stars)
+                render_policy.render(universe)
@@ -0,0 +1,308 @@
+from __future__ import absolute_import
+from time import time
+from threading import Thread, Event, Lock, current_thread
+from Queue import Queue, Full, Empty
+import numpy as np
+from .state import Universe
+
+__all__ = ['SpriteRenderer', 'RenderCadence', 'Headless', 'ThreadedRenderer']
+
+###################################
+###
+### Render Policies
+###
+###################################
+
+class SpriteRenderer(object):
+    """Draws Frames on a surface incrementally.
+
+    The hollow circle of each (radius, star) pair is drawn once into a cached
+    sprite, which is then blitted for every point with that radius and color.
+    A sprite is identified by its position, radius and star flag, so draw()
+    only erases the sprites of the previous frame that are gone and draws the
+    new ones, redrawing the sprites they overlap clipped to the changed
+    rectangles. It returns only those rectangles, none for an unchanged
+    frame, so that only they are copied to the screen with display.update.
+    When more than a quarter of the sprites changed, ex. when every point
+    moves, the surface is cleared and all the sprites are drawn again, which
+    is cheaper.
+
+    Above "density_threshold" points the circles are not drawn anymore, the
+    points are counted per pixel with a single histogram instead, which is
+    drawn in one call as a grey density map (log scaled).
+
+    Attributes:
+        _density_threshold: Number of points above which a density map is
+            drawn.
+        _sprites: dict of (radius, star) to the sprite of the circle.
+        _drawn: set of the (position, radius, star) sprites of the last frame,
+            or None if the whole surface has to be redrawn.
+    """
+
+    def __init__(self, density_threshold=5000):
+        self._density_threshold = density_threshold
+        self._sprites = {}
+        self._drawn = None
+
+    def sprite(self, radius, star):
+        """Returns the cached sprite of a circle, the circle is centered on
+        (radius + 1, radius + 1) and black is transparent.
+        """
+        key = (radius, star)
+        if key not in self._sprites:
+            from pygame import Surface, draw
+            sprite = Surface((2 * radius + 3, 2 * radius + 3))
+            sprite.fill(Universe.BACKGROUND_COLOR)
+            sprite.set_colorkey(Universe.BACKGROUND_COLOR)
+            color = Universe.STAR_COLOR if star else Universe.NOT_STAR_COLOR
+            draw.circle(sprite, color, (radius + 1, radius + 1), radius, Universe.BORDER_THICKNESS)
+            self._sprites[key] = sprite.convert() if self._display_initialized() else sprite
+        return self._sprites[key]
+
+    @staticmethod
+    def _display_initialized():
+        from pygame import display
+        return display.get_init() and display.get_surface() is not None
+
+    @staticmethod
+    def _rect(key):
+        from pygame import Rect
+        (x, y), radius, _ = key
+        return Rect(x - radius - 1, y - radius - 1, 2 * radius + 3, 2 * radius + 3)
+
+    def draw(self, surface, frame):
+        """Draws "frame" over the previous frame drawn on "surface".
+
+        Returns:
+            List of the rectangles of "surface" that changed.
+        """
+        if len(frame) > self._density_threshold:
+            return self._draw_density(surface, frame)
+        keys = list(zip(frame.positions, frame.radii, frame.stars))
+        drawn = set(keys)
+        if self._drawn is None:
+            self._drawn = drawn
+            self._blit(surface, keys)
+            return [surface.get_rect()]
+        removed = [self._rect(key) for key in self._drawn - drawn]
+        added = [self._rect(key) for key in drawn - self._drawn]
+        self._drawn = drawn
+        if 4 * (len(removed) + len(added)) > len(keys):
+            self._blit(surface, keys)
+            return removed + [self._rect(key) for key in keys]
+        rects = [self._rect(key) for key in keys]
+        fill = surface.fill
+        set_clip = surface.set_clip
+        for changed in removed + added:
+            set_clip(changed)
+            fill(Universe.BACKGROUND_COLOR)
+            self._blit_keys(surface, [keys[i] for i in changed.collidelistall(rects)])
+        set_clip(None)
+        return removed + added
+
+    def _blit(self, surface, keys):
+        # One fill of the surface is much cheaper than a fill per rectangle.
+        surface.fill(Universe.BACKGROUND_COLOR)
+        self._blit_keys(surface, keys)
+
+    def _blit_keys(self, surface, keys):
+        blit = surface.blit
+        sprite = self.sprite
+        for (x, y), radius, star in keys:
+            blit(sprite(radius, star), (x - radius - 1, y - radius - 1))
+
+    def _draw_density(self, surface, frame):
+        from pygame import surfarray
+        width, height = surface.get_size()
+        positions = np.array(frame.positions, dtype=float).reshape(len(frame), 2)
+        counts, x_edges, y_edges = np.histogram2d(positions[:, 0], positions[:, 1], bins=(width, height), range=((0, width), (0, height)))
+        shades = np.log1p(counts)
+        if shades.max() > 0:
+            shades *= 255.0 / shades.max()
+        surfarray.blit_array(surface, np.repeat(shades.astype(np.uint8)[:, :, np.newaxis], 3, axis=2))
+        # The next sprite frame redraws everything.
+        self._drawn = None
+        return [surface.get_rect()]
+
+    def __repr__(self):
+        return "\nSpriteRenderer(%r)" % (self._density_threshold)
+
+class RenderCadence(object):
+    """Draws the universe every "every" iterations, but at most "max_fps" times
+    per second.
+
+    A render policy decides on which iterations should_render(iteration), and
+    then render(universe) is called. close(universe) is called when the
+    simulation ends.
+
+    Attributes:
+        _every: Number of iterations between frames.
+        _max_fps: Maximum number of frames per second, or None for no limit.
+        _last_render: Time of the last frame.
+    """
+
+    def __init__(self, every=1, max_fps=None):
+        self._every = every
+        self._max_fps = max_fps
+        self._last_render = 0.0
+
+    def should_render(self, iteration):
+        if iteration % self._every:
+            return False
+        if self._max_fps is not None:
+            now = time()
+            if now - self._last_render < 1.0 / self._max_fps:
+                return False
+            self._last_render = now
+        return True
+
+    def render(self, universe):
+        universe.draw()
+
+    def close(self, universe):
+        """Closes the window and exits the program."""
+        universe.close()
+
+    def __repr__(self):
+        return "\nRenderCadence(every=%r, max_fps=%r)" % (self._every, self._max_fps)
+
+class Headless(object):
+    """Never draws the universe, so the simulation never touches pygame, and
+    lets Simulator.run return when the simulation ends.
+    """
+
+    def should_render(self, iteration):
+        return False
+
+    def render(self, universe):
+        pass
+
+    def close(self, universe):
+        pass
+
+    def __repr__(self):
+        return "\nHeadless()"
+
+class ThreadedRenderer(object):
+    """Draws the universe on a background thread, so that physics never waits
+    on the display and the display never waits on a slow step.
+
+    Every "every" iterations the simulation pushes an immutable Frame into a
+    bounded queue, dropping the oldest queued frame instead of blocking when
+    the queue is full. The renderer thread wakes up "fps" times per second,
+    draws only the most recent queued frame (dropping the others) and handles
+    the window events. When the window is closed the next render() call exits
+    the program, like Universe.draw() does. close() waits for the last queued
+    frame to be drawn. Frames are drawn by a SpriteRenderer.
+
+    Attributes:
+        _every: Number of iterations between frames.
+        _fps: Refresh rate of the renderer thread.
+        _queue_size: Maximum number of queued frames.
+        _density_threshold: Number of points above which a density map is
+            drawn, see SpriteRenderer.
+        _queue: Queue of frames (not serialized).
+        _thread: The renderer thread (not serialized).
+        _stopping: Event telling the renderer thread to stop.
+        _closed: Whether the window was closed.
+        _rendered: Number of frames drawn.
+        _dropped: Number of frames dropped, by either thread.
+        _lock: Lock guarding "_dropped".
+    """
+
+    def __init__(self, every=1, fps=60, queue_size=2, density_threshold=Universe.DENSITY_THRESHOLD):
+        self._every = every
+        self._fps = fps
+        self._queue_size = queue_size
+        self._density_threshold = density_threshold
+        self._reset()
+
+    def _reset(self):
+        self._queue = Queue(self._queue_size)
+        self._thread = None
+        self._stopping = Event()
+        self._closed = False
+        self._rendered = 0
+        self._dropped = 0
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {'_every': self._every, '_fps': self._fps, '_queue_size': self._queue_size, '_density_threshold': self._density_threshold}
+
+    def __setstate__(self, state):
+        self._density_threshold = Universe.DENSITY_THRESHOLD
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def rendered(self):
+        return self._rendered
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def should_render(self, iteration):
+        return iteration % self._every == 0
+
+    def render(self, universe):
+        """Queues a frame of the universe without blocking."""
+        if self._closed:
+            self.close(universe)
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='ThreadedRenderer')
+            self._thread.daemon = True
+            self._thread.start()
+        frame = universe.frame()
+        while True:
+            try:
+                self._queue.put_nowait(frame)
+                return
+            except Full:
+                try:
+                    self._queue.get_nowait()
+                except Empty:
+                    continue
+                with self._lock:
+                    self._dropped += 1
+
+    def _run(self):
+        from pygame import display, event, QUIT
+        surface = display.set_mode((Universe.SIZE, Universe.SIZE))
+        renderer = SpriteRenderer(self._density_threshold)
+        interval = 1.0 / self._fps
+        while True:
+            # The last frame queued before close() is still drawn.
+            stopping = self._stopping.is_set()
+            started = time()
+            frame = None
+            try:
+                while True:
+                    latest = self._queue.get_nowait()
+                    if frame is not None:
+                        with self._lock:
+                            self._dropped += 1
+                    frame = latest
+            except Empty:
+                pass
+            if frame is not None:
+                display.update(renderer.draw(surface, frame))
+                self._rendered += 1
+            for e in event.get():
+                if e.type == QUIT:
+                    self._closed = True
+            if stopping:
+                return
+            self._stopping.wait(max(0.0, interval - (time() - started)))
+
+    def close(self, universe):
+        """Stops the renderer thread, closes the window and exits the
+        program.
+        """
+        self._stopping.set()
+        if self._thread is not None and self._thread is not current_thread():
+            self._thread.join()
+        universe.close()
+
+    def __repr__(self):
+        return "\nThreadedRenderer(every=%r, fps=%r, queue_size=%r, density_threshold=%r)" % (self._every, self._fps, self._queue_size, self._density_threshold)
@@ -0,0 +1,585 @@
+from __future__ import absolute_import
+from heapq import heapify, heappush, heappop
+import numpy as np
+from .integrators import NUMBA_AVAILABLE
+from .spatial import SpatialHash
+from .state import ChangeFeed, Point, Vector2D
+
+__all__ = ['MergeCollision', 'ClusterMergeCollision', 'SweptMergeCollision', 'StarFormation']
+
+###################################
+###
+### Resolution Policies
+###
+###################################
+
+class MergeCollision(object):
+    """Merges points in a universe when they collide.
+
+    Attributes:
+        _compiled: whether to find the overlapping pairs with a native sweep
+            compiled with Numba and drive the merges from them, instead of the
+            SpatialHash broad phase. Ignored without Numba.
+        _interactions: Number of pairs tested by the last resolve.
+    """
+
+    def __init__(self, compiled=False):
+        self._compiled = compiled
+        self._interactions = 0
+
+    def __getstate__(self):
+        return {'_compiled': self._compiled}
+
+    def __setstate__(self, state):
+        self._compiled = False
+        self.__dict__.update(state)
+        self._interactions = 0
+
+    @property
+    def interactions(self):
+        return self._interactions
+
+    @staticmethod
+    def merge(p1, p2):
+        """Merges "p2" into "p1", conserving mass, momentum and area.
+
+        Mutates:
+            p1: Moved to the center of mass of the pair with the total mass,
+                the momentum conserving velocity and the combined area.
+        """
+        # float so that integer states are not truncated by integer division
+        total_mass = float(p1.mass + p2.mass)
+        center_of_mass = (p1.position * p1.mass + p2.position * p2.mass) / total_mass
+        total_velocity = (p1.velocity * p1.mass + p2.velocity * p2.mass) /  total_mass
+        total_radius = Point.radius_from_area(p1.area + p2.area)
+        p1.position = center_of_mass
+        p1.velocity = total_velocity
+        p1.mass = total_mass
+        p1.radius = total_radius
+
+    @staticmethod
+    def _build_grid(points, alive):
+        """Returns a SpatialHash of the indices in "alive", with cells of twice
+        the largest radius.
+        """
+        max_radius = max(points[i].radius for i in alive)
+        grid = SpatialHash(max(2 * max_radius, 1))
+        for i in alive:
+            position = points[i].position
+            grid.insert(i, position.x, position.y)
+        return grid
+
+    def resolve(self, universe):
+        """When two points are closer than the distance of their combined radii
+        , this resolution policy merges them into one point, conserving mass,
+        momentum, and area, and publishes the merges on the change feed of the
+        universe. Candidate pairs come from a SpatialHash broad phase
+        with cells of twice the largest radius, so only points in neighbouring
+        cells are tested and the cost scales with n and the local density.
+
+        The points are examined in list order. A point that overlaps others is
+        merged with the first of them in list order, and the earlier point of
+        the pair survives and is examined again, since it has grown.
+
+        Args:
+            universe: The universe to revolve.
+   
+        Mutates:
+            universe: For each collision one point is removed and the other
+            point is mutated such that momentum is conserved, mass is conserved,
+            and the area of the remaining point equals the area of the original
+            two points.
+        """
+        points = list(universe.points)
+        self._interactions = 0
+        if len(points) < 2:
+            return
+        if self._compiled and NUMBA_AVAILABLE:
+            self._resolve_compiled(universe, points)
+            return
+        alive = set(xrange(len(points)))
+        grid = MergeCollision._build_grid(points, alive)
+        pending = range(len(points) - 1, -1, -1)
+        while pending:
+            i = pending.pop()
+            if i not in alive:
+                continue
+            p = points[i]
+            candidates = grid.nearby(p.position.x, p.position.y)
+            self._interactions += len(candidates) - 1
+            overlapping = [j for j in candidates
+                if j != i and (p.position - points[j].position).length < p.radius + points[j].radius]
+            if not overlapping:
+                continue
+            survivor, absorbed = sorted((i, min(overlapping)))
+            for index in (survivor, absorbed):
+                position = points[index].position
+                grid.remove(index, position.x, position.y)
+            MergeCollision.merge(points[survivor], points[absorbed])
+            universe.changes.publish(ChangeFeed.MERGED, points[survivor], points[absorbed])
+            alive.remove(absorbed)
+            if 2 * points[survivor].radius > grid.cell_size:
+                grid = MergeCollision._build_grid(points, alive)
+            else:
+                position = points[survivor].position
+                grid.insert(survivor, position.x, position.y)
+            pending.append(survivor)
+        if len(alive) < len(points):
+            universe.remove_points([points[index] for index in xrange(len(points)) if index not in alive])
+
+    @staticmethod
+    def overlapping_pairs(xs, ys, radii):
+        """Returns a tuple (first, second, tested) of the index arrays of the
+        overlapping pairs, first < second, found by the compiled sweep over
+        the points in order of x, and the number of pairs tested.
+        """
+        order = np.argsort(xs, kind='mergesort')
+        first, second, tested = _overlapping_pairs_kernel(xs, ys, radii, order, radii.max())
+        swap = first > second
+        first[swap], second[swap] = second[swap], first[swap]
+        return first, second, tested
+
+    def _resolve_compiled(self, universe, points):
+        """Same merges as resolve, in the same order, driven by the pairs of
+        the compiled sweep.
+
+        Points that have not merged keep the overlaps found by the sweep. A
+        grown survivor is examined again right away until it overlaps nothing,
+        so only survivors are tested again, with NumPy, against the points of
+        the sweep near them and the other survivors; and a point of the sweep
+        without overlapping pairs never has to be examined.
+        """
+        positions = universe.kinematics()[0]
+        xs = np.ascontiguousarray(positions[:, 0])
+        ys = np.ascontiguousarray(positions[:, 1])
+        radii = np.array([point.radius for point in points], dtype=float)
+        first, second, tested = MergeCollision.overlapping_pairs(xs, ys, radii)
+        self._interactions += tested
+        if not len(first):
+            return
+        neighbours = {}
+        for i, j in zip(first.tolist(), second.tolist()):
+            neighbours.setdefault(i, []).append(j)
+            neighbours.setdefault(j, []).append(i)
+        order = np.argsort(xs, kind='mergesort')
+        sorted_xs = xs[order]
+        # Points whose position and radius are still those of the sweep.
+        swept = np.ones(len(points), dtype=bool)
+        alive = np.ones(len(points), dtype=bool)
+        grown = np.empty(len(points), dtype=np.intp)
+        grown_count = 0
+        max_radius = radii.max()
+        pending = sorted(neighbours, reverse=True)
+        while pending:
+            i = pending.pop()
+            if not alive[i]:
+                continue
+            if swept[i]:
+                candidates = np.array(neighbours[i], dtype=np.intp)
+                candidates = candidates[swept[candidates] & alive[candidates]]
+            else:
+                low = np.searchsorted(sorted_xs, xs[i] - radii[i] - max_radius, 'left')
+                high = np.searchsorted(sorted_xs, xs[i] + radii[i] + max_radius, 'right')
+                window = order[low:high]
+                others = grown[:grown_count]
+                candidates = np.concatenate((window[swept[window] & alive[window]], others[alive[others] & (others != i)]))
+            self._interactions += len(candidates)
+            distances = np.sqrt((xs[i] - xs[candidates]) ** 2 + (ys[i] - ys[candidates]) ** 2)
+            overlapping = candidates[distances < radii[i] + radii[candidates]]
+            if not len(overlapping):
+                continue
+            survivor, absorbed = sorted((i, int(overlapping.min())))
+            MergeCollision.merge(points[survivor], points[absorbed])
+            universe.changes.publish(ChangeFeed.MERGED, points[survivor], points[absorbed])
+            alive[absorbed] = False
+            position = points[survivor].position
+            xs[survivor], ys[survivor], radii[survivor] = position.x, position.y, points[survivor].radius
+            max_radius = max(max_radius, radii[survivor])
+            if swept[survivor]:
+                swept[survivor] = False
+                grown[grown_count] = survivor
+                grown_count += 1
+            pending.append(survivor)
+        universe.remove_points([points[index] for index in np.nonzero(~alive)[0].tolist()])
+
+    def __repr__(self):
+        if self._compiled:
+            return "\nMergeCollision(compiled=True)"
+        return "\nMergeCollision()"
+
+if NUMBA_AVAILABLE:
+    from numba import njit
+
+    @njit(cache=True)
+    def _overlapping_pairs_kernel(xs, ys, radii, order, max_radius):
+        """Sweeps the points in order of x and returns the index arrays of the
+        overlapping pairs and the number of pairs tested.
+        """
+        capacity = 64
+        first = np.empty(capacity, dtype=np.int64)
+        second = np.empty(capacity, dtype=np.int64)
+        count = 0
+        tested = 0
+        for a in range(order.shape[0]):
+            i = order[a]
+            for b in range(a + 1, order.shape[0]):
+                j = order[b]
+                if xs[j] - xs[i] >= radii[i] + max_radius:
+                    break
+                tested += 1
+                diff_x = xs[j] - xs[i]
+                diff_y = ys[j] - ys[i]
+                if np.sqrt(diff_x * diff_x + diff_y * diff_y) < radii[i] + radii[j]:
+                    if count == capacity:
+                        capacity *= 2
+                        first = np.concatenate((first, np.empty(capacity - count, dtype=np.int64)))
+                        second = np.concatenate((second, np.empty(capacity - count, dtype=np.int64)))
+                    first[count] = i
+                    second[count] = j
+                    count += 1
+        return first[:count].copy(), second[:count].copy(), tested
+
+class ClusterMergeCollision(object):
+    """Merges every group of overlapping points in a universe in a single pass.
+
+    All overlapping pairs are found once, using a SpatialHash broad phase,
+    grouped into connected components with union-find, and each component is
+    merged into one point in one shot. Unlike MergeCollision a merged point is
+    not tested again until the next step.
+
+    Attributes:
+        _interactions: Number of pairs tested by the last resolve.
+    """
+
+    def __init__(self):
+        self._interactions = 0
+
+    @property
+    def interactions(self):
+        return self._interactions
+
+    @staticmethod
+    def overlapping_pairs(points):
+        """Returns a tuple (pairs, tested) of the list of index pairs (i, j),
+        i < j, of overlapping points and the number of candidate pairs tested.
+        """
+        if len(points) < 2:
+            return [], 0
+        grid = MergeCollision._build_grid(points, xrange(len(points)))
+        pairs = []
+        tested = 0
+        for i, p in enumerate(points):
+            for j in grid.nearby(p.position.x, p.position.y):
+                if j > i:
+                    tested += 1
+                    if (p.position - points[j].position).length < p.radius + points[j].radius:
+                        pairs.append((i, j))
+        return pairs, tested
+
+    @staticmethod
+    def components(count, pairs):
+        """Groups indices 0..count-1 connected by "pairs" with union-find.
+
+        Returns:
+            List of components with more than one index, each a sorted list.
+        """
+        parent = range(count)
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        for i, j in pairs:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        groups = {}
+        for i in xrange(count):
+            groups.setdefault(find(i), []).append(i)
+        return [group for root, group in sorted(groups.items()) if len(group) > 1]
+
+    @staticmethod
+    def merge_all(points):
+        """Merges "points" into points[0], conserving mass, momentum and area.
+        The result does not depend on the order of "points": the sums are
+        accumulated in a canonical order and the merged point is a star if any
+        of the points is.
+
+        Mutates:
+            points[0]: Moved to the center of mass with the total mass, the
+                momentum conserving velocity and the combined area.
+        """
+        canonical = sorted(points, key=lambda point: (point.position.tuple, point.velocity.tuple, point.mass, point.radius, point.star))
+        total_mass = float(sum(point.mass for point in canonical))
+        center_of_mass = Vector2D.zero()
+        total_velocity = Vector2D.zero()
+        total_area = 0.0
+        for point in canonical:
+            center_of_mass = center_of_mass + point.position * point.mass
+            total_velocity = total_velocity + point.velocity * point.mass
+            total_area += point.area
+        survivor = points[0]
+        survivor.position = center_of_mass / total_mass
+        survivor.velocity = total_velocity / total_mass
+        survivor.mass = total_mass
+        survivor.radius = Point.radius_from_area(total_area)
+        survivor.star = any(point.star for point in canonical)
+
+    def resolve(self, universe):
+        """Merges each connected component of overlapping points into the point
+        of the component that comes first in the list, and publishes the merges
+        on the change feed of the universe.
+
+        Args:
+            universe: The universe to revolve.
+
+        Mutates:
+            universe: Each component of overlapping points is replaced by a
+            single point conserving the mass, momentum and area of the
+            component.
+        """
+        points = list(universe.points)
+        pairs, self._interactions = ClusterMergeCollision.overlapping_pairs(points)
+        components = ClusterMergeCollision.components(len(points), pairs)
+        if not components:
+            return
+        removed = []
+        for component in components:
+            ClusterMergeCollision.merge_all([points[i] for i in component])
+            for i in component[1:]:
+                universe.changes.publish(ChangeFeed.MERGED, points[component[0]], points[i])
+                removed.append(points[i])
+        universe.remove_points(removed)
+
+    def __repr__(self):
+        return "\nClusterMergeCollision()"
+
+class SweptMergeCollision(object):
+    """Merges points in a universe whose circles touched at any time during
+    the last step, not only at its end, so that fast points can not tunnel
+    through each other at large time steps.
+
+    Each point is assumed to have moved in a straight line from its position
+    at the end of the previous resolve to its current position. The contacts
+    between the swept circles are merged in order of their contact time, the
+    merged point continuing on the straight line of the center of mass of the
+    pair, which is tested again against the other points from its contact
+    time on. Merging conserves mass, momentum and area as in MergeCollision,
+    so the merged point ends at the center of mass of the current positions.
+
+    Points without a previous position (on the first resolve, or added since)
+    are tested at their current position only.
+
+    Attributes:
+        _previous: list of [x, y] positions of the points at the end of the
+            previous resolve.
+        _points: the points _previous belongs to, matched by identity (not
+            serialized). After deserialization _previous is matched with the
+            points by order, if their number matches.
+        _interactions: Number of pairs tested by the last resolve.
+    """
+
+    def __init__(self):
+        self._previous = None
+        self._points = None
+        self._interactions = 0
+
+    def __getstate__(self):
+        return {'_previous': self._previous}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._points = None
+        self._interactions = 0
+
+    @property
+    def interactions(self):
+        return self._interactions
+
+    def _start_positions(self, points, ends):
+        """Returns the (n, 2) array of the positions of "points" at the start
+        of the step, their current position "ends" if unknown.
+        """
+        starts = ends.copy()
+        if self._previous is None:
+            return starts
+        if self._points is None:
+            if len(self._previous) == len(points):
+                starts[...] = self._previous
+            return starts
+        previous = dict((id(point), k) for k, point in enumerate(self._points))
+        for i, point in enumerate(points):
+            k = previous.get(id(point))
+            if k is not None:
+                starts[i] = self._previous[k]
+        return starts
+
+    @staticmethod
+    def contact_times(starts, ends, radii, i, j, after=0.0):
+        """Returns the earliest times in [after, 1] (as a fraction of the
+        step) at which the circles of the points i and j, moving in straight
+        lines from "starts" to "ends", touch, or inf if they do not.
+        """
+        offset = starts[i] - starts[j]
+        motion = (ends[i] - starts[i]) - (ends[j] - starts[j])
+        reach = radii[i] + radii[j]
+        a = np.einsum('ij,ij->i', motion, motion)
+        b = 2 * np.einsum('ij,ij->i', offset, motion)
+        c = np.einsum('ij,ij->i', offset, offset) - reach * reach
+        times = np.full(len(offset), np.inf)
+        gap_at_after = a * after * after + b * after + c
+        # Overlapping at "after" already, or approaching contact later on.
+        times[gap_at_after < 0] = after
+        with np.errstate(divide='ignore', invalid='ignore'):
+            root = (-b - np.sqrt(b * b - 4 * a * c)) / (2 * a)
+            approaching = (gap_at_after >= 0) & (a > 0) & (root >= after) & (root <= 1)
+        times[approaching] = root[approaching]
+        return times
+
+    def resolve(self, universe):
+        """Merges the points whose swept circles touched during the step, the
+        earliest contact first, and publishes the merges on the change feed of
+        the universe.
+
+        Args:
+            universe: The universe to revolve.
+
+        Mutates:
+            universe: For each contact one point is removed and the other,
+            the earlier of the pair in list order, is mutated such that mass,
+            momentum and area are conserved.
+        """
+        points = list(universe.points)
+        count = len(points)
+        ends = np.array([point.position.tuple for point in points], dtype=float).reshape(count, 2)
+        starts = self._start_positions(points, ends)
+        radii = np.array([point.radius for point in points], dtype=float)
+        masses = np.array([point.mass for point in points], dtype=float)
+        self._interactions = 0
+        removed = []
+        if count > 1:
+            midpoints = (starts + ends) / 2
+            reach = radii + np.sqrt(np.einsum('ij,ij->i', ends - starts, ends - starts)) / 2
+            i, j = SpatialHash.pairs_within(midpoints, 2 * reach.max() + 1e-9)
+            earlier = i < j
+            i, j = i[earlier], j[earlier]
+            self._interactions = len(i)
+            times = SweptMergeCollision.contact_times(starts, ends, radii, i, j)
+            # Contacts are (time, survivor, absorbed, merges of survivor,
+            # merges of absorbed), those of points which merged since are stale.
+            contacts = [(time, a, b, 0, 0) for time, a, b in zip(times.tolist(), i.tolist(), j.tolist()) if time <= 1]
+            heapify(contacts)
+            alive = np.ones(count, dtype=bool)
+            merges = [0] * count
+            while contacts:
+                time, survivor, absorbed, survivor_merges, absorbed_merges = heappop(contacts)
+                if not (alive[survivor] and alive[absorbed]) or merges[survivor] != survivor_merges or merges[absorbed] != absorbed_merges:
+                    continue
+                MergeCollision.merge(points[survivor], points[absorbed])
+                universe.changes.publish(ChangeFeed.MERGED, points[survivor], points[absorbed])
+                removed.append(points[absorbed])
+                alive[absorbed] = False
+                total_mass = masses[survivor] + masses[absorbed]
+                for positions in (starts, ends):
+                    positions[survivor] = (positions[survivor] * masses[survivor] + positions[absorbed] * masses[absorbed]) / total_mass
+                masses[survivor] = total_mass
+                radii[survivor] = points[survivor].radius
+                merges[survivor] += 1
+                others = np.nonzero(alive)[0]
+                others = others[others != survivor]
+                self._interactions += len(others)
+                times = SweptMergeCollision.contact_times(starts, ends, radii, np.full(len(others), survivor), others, time)
+                for other_time, other in zip(times.tolist(), others.tolist()):
+                    if other_time <= 1:
+                        first, second = min(survivor, other), max(survivor, other)
+                        heappush(contacts, (other_time, first, second, merges[first], merges[second]))
+            if removed:
+                universe.remove_points(removed)
+        self._points = list(universe.points)
+        self._previous = [list(point.position.tuple) for point in self._points]
+
+    def __repr__(self):
+        return "\nSweptMergeCollision()"
+
+class StarFormation(object):
+    """Turns points into stars if their mass is above the "threshold_mass".
+
+    Since masses only change when points merge, an incremental StarFormation
+    subscribes to the change feed of the universe and only examines the points
+    that merged or changed mass since its last step. It scans every point on
+    its first step, after the points were replaced, and when more events than
+    points are pending. Code that changes masses without publishing a
+    MASS_CHANGED event needs incremental=False, which always scans.
+
+    Attributes:
+        _threshold_mass: Mass beyond which a point becomes a star.
+        _incremental: Whether to only examine the changed points.
+        _changes: ChangeFeed subscribed to (not serialized).
+        _subscription: Subscription to _changes (not serialized).
+    """
+    def __init__(self, threshold_mass=500, incremental=True):
+        self._threshold_mass = threshold_mass
+        self._incremental = incremental
+        self._changes = None
+        self._subscription = None
+
+    def __getstate__(self):
+        return {'_threshold_mass': self._threshold_mass, '_incremental': self._incremental}
+
+    def __setstate__(self, state):
+        self._incremental = True
+        self.__dict__.update(state)
+        self._changes = None
+        self._subscription = None
+
+    @property
+    def threshold_mass(self):
+        return self._threshold_mass
+
+    def _changed_points(self, universe):
+        """Returns the points that merged or changed mass since the last call,
+        or None if every point has to be examined.
+        """
+        if not self._incremental:
+            return None
+        if universe.changes is not self._changes:
+            if self._changes is not None:
+                self._changes.unsubscribe(self._subscription)
+            self._changes = universe.changes
+            self._subscription = self._changes.subscribe()
+            return None
+        if self._changes.pending(self._subscription) > len(universe.points):
+            self._changes.read(self._subscription)
+            return None
+        changed = {}
+        for kind, point, other in self._changes.read(self._subscription):
+            if kind == ChangeFeed.RESET:
+                return None
+            elif kind in (ChangeFeed.MERGED, ChangeFeed.MASS_CHANGED):
+                changed[point] = True
+            elif kind == ChangeFeed.REMOVED:
+                changed.pop(point, None)
+        return changed.keys()
+
+    def resolve(self, universe):
+        """When a point has a mass that is greater than "_threshold_mass" it is 
+        turned into a star.
+
+        Args:
+            universe: The universe to revolve.
+   
+        Mutates:
+            universe: The "_star" field of the points in the "universe" that
+            have mass that exceeds the "_threshold_mass" will be set to True.
+        """
+        points = self._changed_points(universe)
+        if points is None:
+            points = universe.points
+        for point in points:
+            if (point.mass > self.threshold_mass):
+                point.star = True
+
+    def __repr__(self):
+        if not self._incremental:
+            return "\nStarFormation(%r, incremental=False)" % (self._threshold_mass)
+        return "\nStarFormation(%r)" % (self._threshold_mass)
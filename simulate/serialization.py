@@ -0,0 +1,313 @@
+from __future__ import absolute_import
+from sys import modules
+from random import getstate, setstate
+from struct import pack, unpack, calcsize
+from json import dumps, loads
+import numpy as np
+from .simulator import Simulator
+from .state import ArrayUniverse, Diagnostics, Point, Vector2D
+
+__all__ = ['Serialize', 'MappedSnapshot']
+
+###################################
+###
+### Serialization
+###
+###################################
+
+class Serialize(object):
+    """A collection of static methods for serializing.
+
+    encode/decode and to_file/from_file produce jsonpickle text, which is
+    handy for small debugging dumps. to_snapshot/from_snapshot/map_snapshot
+    use a compact binary snapshot format for Universes and Simulators:
+
+        "GSIM", uint32 format version, uint64 header length
+        JSON header with the schema of the policies, the termination condition,
+            the diagnostics of the universe and the layout of the arrays
+        position, velocity, mass, radius and star arrays, each aligned to
+            SNAPSHOT_ALIGNMENT bytes so that they can be memory mapped.
+
+    Policies and termination conditions are stored by class name and state,
+    their __getstate__() (or __dict__) has to consist of JSON values. A
+    policy can also store arrays (ex. caches that a resumed run needs to
+    continue exactly) by returning a dict of them from snapshot_arrays(),
+    they are passed back to its restore_snapshot_arrays().
+    """
+
+    SNAPSHOT_MAGIC = b'GSIM'
+    SNAPSHOT_VERSION = 1
+    SNAPSHOT_PREAMBLE = '<4sIQ'
+    SNAPSHOT_ALIGNMENT = 64
+    SNAPSHOT_ARRAYS = (('positions', '<f8'), ('velocities', '<f8'), ('masses', '<f8'), ('radii', '<i8'), ('stars', '|b1'))
+
+    @staticmethod
+    def to_file(to_encode, filename):
+        text_file = open(filename, "w")
+        text_file.write(Serialize.encode(to_encode))
+        text_file.close()
+
+    @staticmethod
+    def from_file(filename):
+        text_file = open(filename, "r")
+        decoded = Serialize.decode(text_file.read())
+        text_file.close()
+        return decoded
+
+    @staticmethod
+    def encode(to_encode):
+        # jsonpickle is only imported once needed, like pygame in rendering.
+        import jsonpickle
+        return jsonpickle.encode(to_encode)
+
+    @staticmethod
+    def decode(to_decode):
+        import jsonpickle
+        return jsonpickle.decode(dumps(Serialize._with_state(loads(to_decode))))
+
+    @staticmethod
+    def _with_state(flattened):
+        """jsonpickle only calls __setstate__ on a "py/state", so objects
+        flattened from their attributes (ex. by versions without
+        __getstate__) would skip the defaults their __setstate__ fills in.
+        Returns "flattened" with the attributes of such objects moved into a
+        "py/state".
+        """
+        if isinstance(flattened, list):
+            return [Serialize._with_state(item) for item in flattened]
+        if not isinstance(flattened, dict):
+            return flattened
+        flattened = dict((key, Serialize._with_state(value)) for key, value in flattened.items())
+        if 'py/object' in flattened and 'py/state' not in flattened:
+            cls = getattr(modules[__name__.rpartition('.')[0]], flattened['py/object'].rpartition('.')[2], None)
+            if cls is not None and hasattr(cls, '__setstate__'):
+                state = dict((key, value) for key, value in flattened.items() if not key.startswith('py/'))
+                flattened = dict((key, value) for key, value in flattened.items() if key.startswith('py/'))
+                flattened['py/state'] = state
+        return flattened
+
+    @staticmethod
+    def class_named(name):
+        """Returns the class of the simulate package called "name"."""
+        return getattr(modules[__name__.rpartition('.')[0]], name)
+
+    @staticmethod
+    def object_schema(obj):
+        """Returns a JSON compatible {"type", "state"} description of a policy
+        or termination condition.
+        """
+        state = obj.__getstate__() if hasattr(obj, '__getstate__') else obj.__dict__
+        try:
+            dumps(state)
+        except TypeError:
+            raise ValueError("State of %s is not JSON serializable: %r" % (type(obj).__name__, state))
+        return {'type': type(obj).__name__, 'state': state}
+
+    @staticmethod
+    def object_from_schema(schema):
+        """Inverse of object_schema."""
+        cls = Serialize.class_named(schema['type'])
+        obj = cls.__new__(cls)
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(schema['state'])
+        else:
+            obj.__dict__.update(schema['state'])
+        return obj
+
+    @staticmethod
+    def simulator_schema(simulator):
+        return {
+            'evolution_policies': [Serialize.object_schema(policy) for policy in simulator._evolution_policies],
+            'resolution_policies': [Serialize.object_schema(policy) for policy in simulator._resolution_policies],
+            'termination_condition': Serialize.object_schema(simulator._termination_condition),
+            'render_policy': Serialize.object_schema(simulator._render_policy),
+            'iteration': simulator._iteration}
+
+    @staticmethod
+    def simulator_from_schema(schema, universe):
+        simulator = Simulator(
+            [Serialize.object_from_schema(policy) for policy in schema['evolution_policies']],
+            [Serialize.object_from_schema(policy) for policy in schema['resolution_policies']],
+            universe,
+            Serialize.object_from_schema(schema['termination_condition']),
+            Serialize.object_from_schema(schema['render_policy']))
+        simulator._iteration = schema['iteration']
+        return simulator
+
+    @staticmethod
+    def to_snapshot(to_encode, filename):
+        """Writes a Universe or Simulator to a binary snapshot file."""
+        header, arrays = Serialize.snapshot_parts(to_encode)
+        Serialize.write_snapshot(header, arrays, filename)
+
+    @staticmethod
+    def snapshot_parts(to_encode):
+        """Captures the state of a Universe or Simulator for a snapshot.
+
+        Returns:
+            Tuple (header, arrays) of the JSON header and the list of
+            (offset, array) of the snapshot, copies that later steps do not
+            change, for write_snapshot.
+        """
+        simulator = to_encode if isinstance(to_encode, Simulator) else None
+        universe = simulator.universe if simulator else to_encode
+        points = universe if isinstance(universe, ArrayUniverse) else ArrayUniverse(universe.points)
+        diagnostics = universe.diagnostics
+        header = {
+            'universe': type(universe).__name__,
+            'count': len(points.points),
+            # The states of the policies may be their live __dict__.
+            'simulator': loads(dumps(Serialize.simulator_schema(simulator))) if simulator else None,
+            'diagnostics': [diagnostics.kinetic, diagnostics.potential, list(diagnostics.momentum), diagnostics.angular_momentum] if diagnostics else None,
+            'arrays': {}}
+        named = [(name, getattr(points, name), dtype) for name, dtype in Serialize.SNAPSHOT_ARRAYS]
+        if simulator:
+            for kind, policies in Serialize._policies(simulator):
+                for index, policy in enumerate(policies):
+                    if hasattr(policy, 'snapshot_arrays'):
+                        for name, array in sorted(policy.snapshot_arrays().items()):
+                            named.append(('%s.%d.%s' % (kind, index, name), array, np.asarray(array).dtype.str))
+        offset = 0
+        arrays = []
+        for name, array, dtype in named:
+            array = np.array(array, dtype=dtype)
+            header['arrays'][name] = {'dtype': dtype, 'shape': list(array.shape), 'offset': offset}
+            arrays.append((offset, array))
+            offset = Serialize._align(offset + array.nbytes)
+        return header, arrays
+
+    @staticmethod
+    def write_snapshot(header, arrays, filename):
+        """Writes the parts captured by snapshot_parts to a snapshot file."""
+        encoded_header = dumps(header).encode('utf-8')
+        data_start = Serialize._align(calcsize(Serialize.SNAPSHOT_PREAMBLE) + len(encoded_header))
+        with open(filename, 'wb') as snapshot_file:
+            snapshot_file.write(pack(Serialize.SNAPSHOT_PREAMBLE, Serialize.SNAPSHOT_MAGIC, Serialize.SNAPSHOT_VERSION, len(encoded_header)))
+            snapshot_file.write(encoded_header)
+            for array_offset, array in arrays:
+                snapshot_file.seek(data_start + array_offset)
+                snapshot_file.write(array.tobytes())
+
+    @staticmethod
+    def from_snapshot(filename):
+        """Reads a Universe or Simulator from a binary snapshot file."""
+        snapshot = Serialize.map_snapshot(filename)
+        if snapshot.header['universe'] == 'ArrayUniverse':
+            universe = snapshot.universe()
+        else:
+            points = [Point(Vector2D(*position), Vector2D(*velocity), mass, radius, star)
+                for position, velocity, mass, radius, star in zip(snapshot.positions.tolist(), snapshot.velocities.tolist(),
+                    snapshot.masses.tolist(), snapshot.radii.tolist(), snapshot.stars.tolist())]
+            universe = Serialize.class_named(snapshot.header['universe'])(points)
+        diagnostics = snapshot.header.get('diagnostics')
+        if diagnostics is not None:
+            kinetic, potential, momentum, angular_momentum = diagnostics
+            universe.diagnostics = Diagnostics(kinetic, potential, tuple(momentum), angular_momentum)
+        if snapshot.header['simulator'] is None:
+            return universe
+        simulator = Serialize.simulator_from_schema(snapshot.header['simulator'], universe)
+        for kind, policies in Serialize._policies(simulator):
+            for index, policy in enumerate(policies):
+                prefix = '%s.%d.' % (kind, index)
+                arrays = dict((name[len(prefix):], np.array(snapshot.array(name))) for name in snapshot.header['arrays'] if name.startswith(prefix))
+                if arrays:
+                    policy.restore_snapshot_arrays(arrays)
+        return simulator
+
+    @staticmethod
+    def _policies(simulator):
+        return (('evolution_policies', simulator._evolution_policies), ('resolution_policies', simulator._resolution_policies))
+
+    @staticmethod
+    def map_snapshot(filename):
+        """Opens a binary snapshot file without materializing its points.
+
+        Returns:
+            A MappedSnapshot whose arrays are read-only memory maps.
+        """
+        with open(filename, 'rb') as snapshot_file:
+            preamble = snapshot_file.read(calcsize(Serialize.SNAPSHOT_PREAMBLE))
+            magic, version, header_length = unpack(Serialize.SNAPSHOT_PREAMBLE, preamble)
+            if magic != Serialize.SNAPSHOT_MAGIC or version != Serialize.SNAPSHOT_VERSION:
+                raise ValueError("%s is not a version %d snapshot" % (filename, Serialize.SNAPSHOT_VERSION))
+            header = loads(snapshot_file.read(header_length).decode('utf-8'))
+        data_start = Serialize._align(len(preamble) + header_length)
+        arrays = {}
+        for name, layout in header['arrays'].items():
+            shape = tuple(layout['shape'])
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=layout['dtype'])
+            else:
+                arrays[name] = np.memmap(filename, dtype=layout['dtype'], mode='r', offset=data_start + layout['offset'], shape=shape)
+        return MappedSnapshot(header, arrays)
+
+    @staticmethod
+    def random_state():
+        """Returns the state of the random and numpy.random generators as JSON
+        values.
+        """
+        version, internal, gauss = getstate()
+        name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+        return {'random': [version, list(internal), gauss], 'numpy': [name, keys.tolist(), position, has_gauss, cached_gaussian]}
+
+    @staticmethod
+    def set_random_state(state):
+        """Inverse of random_state."""
+        version, internal, gauss = state['random']
+        setstate((version, tuple(internal), gauss))
+        name, keys, position, has_gauss, cached_gaussian = state['numpy']
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), position, has_gauss, cached_gaussian))
+
+    @staticmethod
+    def _align(offset):
+        alignment = Serialize.SNAPSHOT_ALIGNMENT
+        return (offset + alignment - 1) // alignment * alignment
+
+class MappedSnapshot(object):
+    """A binary snapshot whose arrays are memory mapped, see
+    Serialize.map_snapshot.
+
+    Attributes:
+        _header: The decoded JSON header of the snapshot.
+        _arrays: dict of the read-only position, velocity, mass, radius and
+            star arrays.
+    """
+
+    def __init__(self, header, arrays):
+        self._header = header
+        self._arrays = arrays
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def count(self):
+        return self._header['count']
+
+    @property
+    def positions(self):
+        return self._arrays['positions']
+
+    @property
+    def velocities(self):
+        return self._arrays['velocities']
+
+    @property
+    def masses(self):
+        return self._arrays['masses']
+
+    @property
+    def radii(self):
+        return self._arrays['radii']
+
+    @property
+    def stars(self):
+        return self._arrays['stars']
+
+    def array(self, name):
+        return self._arrays[name]
+
+    def universe(self):
+        """Returns an ArrayUniverse holding a copy of the snapshot."""
+        return ArrayUniverse.from_arrays(self.positions, self.velocities, self.masses, self.radii, self.stars)
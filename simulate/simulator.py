@@ -0,0 +1,158 @@
+from __future__ import absolute_import
+from .rendering import RenderCadence
+
+__all__ = ['Simulator']
+
+###################################
+###
+### The Simulator
+###
+###################################
+
+class Simulator(object):
+    """The primary class of the module. The Simulator simulates a universe.
+
+    Attributes:
+        _evolution_policies: List of policies that evolve a universe through one
+            iteration (ex. evolving the universe via gravitational accelerations
+            of its constituents).
+        _resolution_policies: List of policies that resolve a universe
+            immediately after it evolves through one iteration (ex. handling 
+            cases where points collide or stars need to be formed).
+        _universe: The universe to simulate.
+        _termination_condition: The condition that signals when to end the
+            simulation.
+        _render_policy: The policy that decides when and how the universe is
+            drawn (ex. RenderCadence, ThreadedRenderer or Headless).
+        _observers: List of observers (ex. a TrajectoryRecorder) whose
+            observe(iteration, universe) is called after every iteration and
+            whose close() is called when the simulation ends.
+        _profiler: A Profiler whose hooks are called around every policy and
+            draw call, or None. Without a profiler the hooks cost nothing.
+        _checkpointer: A Checkpointer that snapshots the simulation after the
+            iterations it is due, or None.
+        _iteration: Number of iterations already completed.
+    """
+
+    def __init__(self, evolution_policies, resolution_policies, universe, termination_condition, render_policy=None, observers=None, profiler=None, checkpointer=None):
+        self._evolution_policies = evolution_policies
+        self._resolution_policies = resolution_policies
+        self._universe = universe
+        self._termination_condition = termination_condition
+        self._render_policy = render_policy if render_policy is not None else RenderCadence()
+        self._observers = observers if observers is not None else []
+        self._profiler = profiler
+        self._checkpointer = checkpointer
+        self._iteration = 0
+
+    def __setstate__(self, state):
+        self._render_policy = RenderCadence()
+        self._observers = []
+        self._profiler = None
+        self._checkpointer = None
+        self._iteration = 0
+        self.__dict__.update(state)
+
+    @property
+    def universe(self):
+        return self._universe
+
+    @property
+    def iteration(self):
+        return self._iteration
+
+    @staticmethod
+    def resume(filename, observers=None, profiler=None, checkpointer=None):
+        """Continues the simulation saved in a checkpoint (see Checkpointer),
+        or in a snapshot of a Simulator, to the end and returns it.
+
+        The policies, the termination condition (with its count of
+        iterations), the iteration number and the random generators are
+        restored, so the run continues as if it had never stopped. Caches of
+        the policies are either recomputed identically from the restored
+        universe or saved in the checkpoint (see Serialize). Observers,
+        profilers and checkpointers are not saved and are given again.
+        """
+        # serialization imports the Simulator, so it is imported here.
+        from .serialization import Serialize
+        header = Serialize.map_snapshot(filename).header
+        simulator = Serialize.from_snapshot(filename)
+        simulator._observers = observers if observers is not None else []
+        simulator._profiler = profiler
+        simulator._checkpointer = checkpointer
+        if header.get('random') is not None:
+            Serialize.set_random_state(header['random'])
+        simulator.run()
+        return simulator
+
+    def run(self):
+        """Runs the simulation.
+
+        Psuedocode:
+            1) Check whether the simulation should keep keep running.
+            2) Evolves the universe one step.
+            3) Resolves the universe after the evolution.
+            4) Notifies the observers.
+            5) Redraws the universe if the render policy says so.
+            6) Takes a checkpoint if the checkpointer is due.
+            7) Next iteration.
+
+        The policies with a close() (ex. to stop a worker pool), the
+        observers, the checkpointer and the profiler are closed even if a
+        policy raises, so that no worker process is left behind and buffered
+        records and pending checkpoints are written. When the simulation ends the render policy is closed: the
+        window is closed and the program exits, unless the render policy is
+        Headless, which never touches pygame and returns.
+        """
+        step = self._step if self._profiler is None else self._profiled_step
+        try:
+            while self._termination_condition.keep_running(self._universe):
+                step()
+                if self._checkpointer is not None:
+                    self._checkpointer.observe(self)
+        finally:
+            for policy in self._evolution_policies + self._resolution_policies:
+                if hasattr(policy, 'close'):
+                    policy.close()
+            for observer in self._observers:
+                observer.close()
+            if self._checkpointer is not None:
+                self._checkpointer.close()
+            if self._profiler is not None:
+                self._profiler.close()
+        self._render_policy.close(self._universe)
+
+    def _step(self):
+        for evolution_policy in self._evolution_policies:
+            evolution_policy.evolve(self._universe)
+        for resolution_policy in self._resolution_policies:
+            resolution_policy.resolve(self._universe)
+        self._iteration += 1
+        for observer in self._observers:
+            observer.observe(self._iteration, self._universe)
+        if self._render_policy.should_render(self._iteration):
+            self._render_policy.render(self._universe)
+
+    def _profiled_step(self):
+        """Same as _step, with the profiler hooks around every phase."""
+        profiler = self._profiler
+        profiler.start_iteration(self._iteration + 1, self._universe)
+        for evolution_policy in self._evolution_policies:
+            profiler.start_phase(self._universe)
+            evolution_policy.evolve(self._universe)
+            profiler.end_phase(type(evolution_policy).__name__, evolution_policy, self._universe)
+        for resolution_policy in self._resolution_policies:
+            profiler.start_phase(self._universe)
+            resolution_policy.resolve(self._universe)
+            profiler.end_phase(type(resolution_policy).__name__, resolution_policy, self._universe)
+        self._iteration += 1
+        for observer in self._observers:
+            observer.observe(self._iteration, self._universe)
+        if self._render_policy.should_render(self._iteration):
+            profiler.start_phase(self._universe)
+            self._render_policy.render(self._universe)
+            profiler.end_phase('draw', None, self._universe)
+        profiler.end_iteration(self._universe)
+
+    def __repr__(self):
+        return "Simulator(%s, %s, %s, %s, %s)" % (str(self._evolution_policies), str(self._resolution_policies), str(self._universe), str(self._termination_condition), str(self._render_policy))
@@ -0,0 +1,376 @@
+from __future__ import absolute_import
+from math import floor
+import numpy as np
+
+__all__ = ['QuadTree', 'SpatialHash']
+
+###################################
+###
+### Spatial Indexing
+###
+###################################
+
+class QuadTree(object):
+    """Quadtree over a set of bodies holding the mass and center of mass of
+    every node, used for Barnes-Hut force evaluation with NumPy.
+
+    The bodies are sorted by the Morton key of their cell at the deepest of
+    DEPTH levels inside a square root box, so that every node is a range of
+    the sorted bodies. Nodes are stored in flat arrays, level by level: the
+    root has id 0 and the children of a node have consecutive ids. A node is
+    a leaf when it holds at most "leaf_size" bodies or is at the deepest
+    level.
+
+    Forces are evaluated for a leaf (a group of bodies) at a time: the tree is
+    walked once per group for all groups together, which gives an interaction
+    list of far nodes, approximated by their center of mass, and of near
+    leaves, summed body by body. Both lists are then evaluated as array
+    operations, in chunks of at most CHUNK_SIZE terms.
+
+    Attributes:
+        _box: (x0, y0, size) of the root box.
+        _leaf_size: maximum number of bodies of a leaf above the deepest level.
+        _sorted: sorted keys * n + body index, which orders bodies with equal
+            keys by index.
+        _order: body index of each sorted body.
+        _positions, _masses: positions and masses of the sorted bodies.
+        _start, _end: range of the sorted bodies of each node.
+        _x0, _y0, _size: lower left corner and side length of each node.
+        _first_child, _child_count: children of each node, no children for a
+            leaf.
+        _mass, _com: mass and (n, 2) center of mass of each node.
+    """
+
+    DEPTH = 16
+    MARGIN = 0.05
+    CHUNK_SIZE = 1 << 20
+    GROUP_BLOCK = 512
+
+    def __init__(self, positions, masses, leaf_size=16, box=None):
+        if box is None or not QuadTree._inside(positions, box):
+            # Square root box around the bodies, with a margin so that bodies
+            # near the edges can move a little before the tree has to be
+            # rebuilt.
+            low = positions.min(axis=0)
+            high = positions.max(axis=0)
+            size = max((high - low).max(), 1.0) * (1 + 2 * self.MARGIN)
+            center = (low + high) / 2.0
+            box = (float(center[0] - size / 2.0), float(center[1] - size / 2.0), float(size))
+        self._box = tuple(box)
+        self._leaf_size = leaf_size
+        count = len(positions)
+        self._sorted = np.sort(self._keys(positions) * count + np.arange(count))
+        self._build(positions, masses)
+
+    @property
+    def box(self):
+        return self._box
+
+    @staticmethod
+    def _inside(positions, box):
+        x0, y0, size = box
+        return bool(((positions[:, 0] >= x0) & (positions[:, 0] < x0 + size) & (positions[:, 1] >= y0) & (positions[:, 1] < y0 + size)).all())
+
+    @staticmethod
+    def _spread(bits):
+        """Inserts a zero bit after each of the 16 low bits of "bits"."""
+        bits = (bits | (bits << 8)) & 0x00FF00FF
+        bits = (bits | (bits << 4)) & 0x0F0F0F0F
+        bits = (bits | (bits << 2)) & 0x33333333
+        return (bits | (bits << 1)) & 0x55555555
+
+    def _keys(self, positions):
+        """Returns the Morton key of the deepest cell of each position, with
+        the x bit below the y bit of every level.
+        """
+        x0, y0, size = self._box
+        cells = 1 << self.DEPTH
+        scale = cells / size
+        columns = np.clip(((positions[:, 0] - x0) * scale).astype(np.int64), 0, cells - 1)
+        rows = np.clip(((positions[:, 1] - y0) * scale).astype(np.int64), 0, cells - 1)
+        return QuadTree._spread(columns) | (QuadTree._spread(rows) << 1)
+
+    def _build(self, positions, masses):
+        """Builds the nodes, level by level, from the sorted bodies."""
+        count = len(self._sorted)
+        self._order = self._sorted % count
+        keys = self._sorted // count
+        self._positions = positions[self._order]
+        self._masses = masses[self._order]
+        x0, y0, size = self._box
+        levels = []
+        start = np.array([0])
+        end = np.array([count])
+        node_x0 = np.array([x0])
+        node_y0 = np.array([y0])
+        next_id = 1
+        for level in xrange(self.DEPTH + 1):
+            split = (end - start > self._leaf_size) & (level < self.DEPTH)
+            first_child = np.zeros(len(start), dtype=np.intp)
+            child_count = np.zeros(len(start), dtype=np.intp)
+            levels.append((start, end, node_x0, node_y0, np.repeat(size / (1 << level), len(start)), first_child, child_count))
+            if not split.any():
+                break
+            # All the bodies of a node share the key prefix of the node.
+            shift = 2 * (self.DEPTH - level - 1)
+            prefixes = keys[start[split]] >> (shift + 2)
+            bounds = np.searchsorted(keys >> shift, 4 * prefixes[:, np.newaxis] + np.arange(5))
+            nonempty = bounds[:, 1:] > bounds[:, :-1]
+            child_count[split] = nonempty.sum(axis=1)
+            first_child[split] = next_id + np.cumsum(child_count[split]) - child_count[split]
+            next_id += child_count.sum()
+            quadrants = np.nonzero(nonempty)[1]
+            half = size / (2 << level)
+            start = bounds[:, :-1][nonempty]
+            end = bounds[:, 1:][nonempty]
+            node_x0 = np.repeat(node_x0[split], child_count[split]) + half * (quadrants & 1)
+            node_y0 = np.repeat(node_y0[split], child_count[split]) + half * (quadrants >> 1)
+        (self._start, self._end, self._x0, self._y0, self._size, self._first_child, self._child_count) = [np.concatenate(arrays) for arrays in zip(*levels)]
+        # The nodes of a level are disjoint and sorted, so reduceat sums each
+        # of them over its own range; the padding keeps the ends in range.
+        weighted = np.vstack((self._masses, self._masses * self._positions[:, 0], self._masses * self._positions[:, 1], np.zeros(count))).T
+        weighted = np.vstack((weighted, np.zeros((1, 4))))
+        sums = np.concatenate([np.add.reduceat(weighted, np.dstack((level[0], level[1])).ravel(), axis=0)[::2] for level in levels])
+        self._mass = sums[:, 0]
+        centers = np.column_stack((self._x0, self._y0)) + self._size[:, np.newaxis] / 2.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._com = np.where(self._mass[:, np.newaxis] > 0, sums[:, 1:3] / self._mass[:, np.newaxis], centers)
+
+    def refit(self, positions, masses):
+        """Updates the tree for new body positions and masses: only the bodies
+        whose deepest cell changed are removed from the sorted bodies and
+        inserted again, then the nodes are rebuilt from them.
+
+        Returns:
+            False, leaving the tree unchanged, if the number of bodies changed
+            or some body has left the root box (the tree then has to be
+            rebuilt). True otherwise.
+        """
+        count = len(self._sorted)
+        if len(positions) != count or not QuadTree._inside(positions, self._box):
+            return False
+        sorted_keys = np.empty(count, dtype=np.int64)
+        sorted_keys[self._order] = self._sorted
+        keys = self._keys(positions) * count + np.arange(count)
+        moved = keys != sorted_keys
+        if moved.any():
+            kept = self._sorted[~moved[self._order]]
+            inserted = np.sort(keys[moved])
+            self._sorted = np.insert(kept, np.searchsorted(kept, inserted), inserted)
+        self._build(positions, masses)
+        return True
+
+    def _chunks(self, terms):
+        """Yields slices of pairs with at most about CHUNK_SIZE terms."""
+        bounds = np.searchsorted(np.cumsum(terms), np.arange(self.CHUNK_SIZE, terms.sum(), self.CHUNK_SIZE), 'right')
+        for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(terms)]))):
+            if start < stop:
+                yield slice(start, stop)
+
+    @staticmethod
+    def _expand(terms):
+        """Returns the pair and the index within the pair of every term."""
+        pairs = np.repeat(np.arange(len(terms)), terms)
+        return pairs, np.arange(len(pairs)) - np.repeat(np.cumsum(terms) - terms, terms)
+
+    def _interaction_lists(self, groups, theta):
+        """Walks the tree for all the leaves "groups" together.
+
+        Returns:
+            Tuple (far groups, far nodes, near groups, near leaves) of arrays
+            of pairs.
+        """
+        theta_squared = theta * theta
+        low = np.column_stack((self._x0[groups], self._y0[groups]))
+        high = low + self._size[groups][:, np.newaxis]
+        group = np.arange(len(groups))
+        node = np.zeros(len(groups), dtype=np.intp)
+        far_groups, far_nodes, near_groups, near_nodes = [], [], [], []
+        while len(node):
+            com = self._com[node]
+            # Distance from the center of mass to the closest point of the
+            # group cell.
+            gap = np.maximum(np.maximum(low[group] - com, com - high[group]), 0)
+            distance_squared = np.einsum('ij,ij->i', gap, gap)
+            # A node containing the group would count the group itself.
+            contains = ((self._x0[node] <= low[group, 0]) & (low[group, 0] < self._x0[node] + self._size[node])
+                & (self._y0[node] <= low[group, 1]) & (low[group, 1] < self._y0[node] + self._size[node]))
+            far = ~contains & (self._mass[node] > 0) & (self._size[node] ** 2 < theta_squared * distance_squared)
+            far_groups.append(group[far])
+            far_nodes.append(node[far])
+            opened = ~far & (self._mass[node] > 0)
+            leaf = opened & (self._child_count[node] == 0)
+            near_groups.append(group[leaf])
+            near_nodes.append(node[leaf])
+            opened &= ~leaf
+            counts = self._child_count[node[opened]]
+            group = np.repeat(group[opened], counts)
+            node = QuadTree._expand(counts)[1] + np.repeat(self._first_child[node[opened]], counts)
+        return tuple(np.concatenate(pairs) for pairs in (far_groups, far_nodes, near_groups, near_nodes))
+
+    def accelerations(self, theta, potentials=None):
+        """Computes the gravitational acceleration of every body due to all
+        other bodies, approximating a node by its center of mass when
+        size / distance < "theta" for the distance to the cell of the leaf of
+        the body.
+
+        Args:
+            theta: opening angle.
+            potentials: Optional (n,) array the gravitational potentials of
+                the bodies are written to, with the same approximation.
+        Returns:
+            Tuple ((n, 2) array of accelerations, number of body-body and
+            body-node terms evaluated).
+        """
+        count = len(self._order)
+        accelerations = np.zeros((count, 2))
+        sorted_potentials = np.zeros(count) if potentials is not None else None
+        interactions = 0
+        leaves = np.nonzero(self._child_count == 0)[0]
+        for block in xrange(0, len(leaves), self.GROUP_BLOCK):
+            groups = leaves[block:block + self.GROUP_BLOCK]
+            far_groups, far_nodes, near_groups, near_nodes = self._interaction_lists(groups, theta)
+            group_start = self._start[groups]
+            group_count = self._end[groups] - group_start
+            # Every body of the group with the center of mass of the node.
+            terms = group_count[far_groups]
+            for chunk in self._chunks(terms):
+                pair, index = QuadTree._expand(terms[chunk])
+                bodies = group_start[far_groups[chunk]][pair] + index
+                nodes = far_nodes[chunk][pair]
+                interactions += self._add(accelerations, bodies, self._com[nodes], self._mass[nodes], sorted_potentials)
+            # Every body of the group with every body of the leaf.
+            leaf_count = self._end[near_nodes] - self._start[near_nodes]
+            terms = group_count[near_groups] * leaf_count
+            for chunk in self._chunks(terms):
+                pair, index = QuadTree._expand(terms[chunk])
+                counts = leaf_count[chunk][pair]
+                bodies = group_start[near_groups[chunk]][pair] + index // counts
+                others = self._start[near_nodes[chunk]][pair] + index % counts
+                interactions += self._add(accelerations, bodies, self._positions[others], self._masses[others], sorted_potentials)
+        result = np.empty_like(accelerations)
+        result[self._order] = accelerations
+        if potentials is not None:
+            potentials[self._order] = sorted_potentials
+        return result, interactions
+
+    def _add(self, accelerations, bodies, sources, masses, potentials=None):
+        """Adds the accelerations of "bodies" (sorted indices) due to point
+        masses at "sources", and their potentials to "potentials" if given.
+
+        Returns:
+            The number of terms with a nonzero distance.
+        """
+        delta = sources - self._positions[bodies]
+        r_squared = np.einsum('ij,ij->i', delta, delta)
+        nonzero = r_squared > 0
+        bodies, delta, r_squared = bodies[nonzero], delta[nonzero], r_squared[nonzero]
+        magnitude = masses[nonzero] / (r_squared * np.sqrt(r_squared))
+        count = len(accelerations)
+        accelerations[:, 0] += np.bincount(bodies, delta[:, 0] * magnitude, count)
+        accelerations[:, 1] += np.bincount(bodies, delta[:, 1] * magnitude, count)
+        if potentials is not None:
+            potentials -= np.bincount(bodies, magnitude * r_squared, count)
+        return len(bodies)
+
+class SpatialHash(object):
+    """Uniform grid that buckets items by the cell containing their position.
+    Used as a broad phase for collision detection: two circles of radius at
+    most r overlap only if they are in neighbouring cells of a grid with cell
+    size 2r.
+
+    Attributes:
+        _cell_size: side length of a cell.
+        _cells: dict mapping (column, row) to the list of items in that cell.
+    """
+
+    def __init__(self, cell_size):
+        self._cell_size = float(cell_size)
+        self._cells = {}
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+    def cell(self, x, y):
+        return (int(floor(x / self._cell_size)), int(floor(y / self._cell_size)))
+
+    def insert(self, item, x, y):
+        self._cells.setdefault(self.cell(x, y), []).append(item)
+
+    def remove(self, item, x, y):
+        key = self.cell(x, y)
+        bucket = self._cells[key]
+        bucket.remove(item)
+        if not bucket:
+            del self._cells[key]
+
+    def nearby(self, x, y):
+        """Returns the items in the cell containing (x, y) and in the eight
+        cells around it.
+        """
+        column, row = self.cell(x, y)
+        items = []
+        for i in xrange(column - 1, column + 2):
+            for j in xrange(row - 1, row + 2):
+                items.extend(self._cells.get((i, j), ()))
+        return items
+
+    @staticmethod
+    def pairs_within(positions, distance):
+        """Vectorized grid search for all pairs of points closer than
+        "distance", with cells of size "distance".
+
+        Args:
+            positions: (n, 2) array of positions.
+            distance: search distance.
+        Returns:
+            Tuple (i, j) of index arrays of the ordered pairs, both (i, j) and
+            (j, i) are included and i != j.
+        """
+        first, second = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)]
+        for i, j in SpatialHash.pair_chunks(positions, distance):
+            first.append(i)
+            second.append(j)
+        return np.concatenate(first), np.concatenate(second)
+
+    @staticmethod
+    def pair_chunks(positions, distance, chunk_size=1 << 20):
+        """Same search as pairs_within, but yields the pairs in chunks of the
+        points, each testing at most about "chunk_size" candidate pairs, so
+        that memory stays bounded however many pairs there are.
+
+        Yields:
+            Tuples (i, j) of index arrays of ordered pairs.
+        """
+        count = len(positions)
+        if count < 2:
+            return
+        cells = np.floor((positions - positions.min(axis=0)) / distance).astype(np.int64) + 1
+        stride = cells[:, 1].max() + 2
+        keys = cells[:, 0] * stride + cells[:, 1]
+        order = np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        offsets = [offset_x * stride + offset_y for offset_x in (-1, 0, 1) for offset_y in (-1, 0, 1)]
+        # Candidates of every point, to cut the points into chunks.
+        candidates = np.zeros(count, dtype=np.int64)
+        for offset in offsets:
+            candidates += np.searchsorted(sorted_keys, keys + offset, 'right') - np.searchsorted(sorted_keys, keys + offset, 'left')
+        bounds = np.searchsorted(np.cumsum(candidates), np.arange(chunk_size, candidates.sum(), chunk_size), 'right')
+        for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [count]))):
+            if start == stop:
+                continue
+            points = np.arange(start, stop)
+            first, second = [], []
+            for offset in offsets:
+                neighbour_keys = keys[points] + offset
+                low = np.searchsorted(sorted_keys, neighbour_keys, 'left')
+                counts = np.searchsorted(sorted_keys, neighbour_keys, 'right') - low
+                i = np.repeat(points, counts)
+                starts = np.repeat(low - np.cumsum(counts) + counts, counts)
+                j = order[starts + np.arange(len(i))]
+                diff = positions[i] - positions[j]
+                close = (i != j) & (np.einsum('ij,ij->i', diff, diff) < distance * distance)
+                first.append(i[close])
+                second.append(j[close])
+            yield np.concatenate(first), np.concatenate(second)
@@ -0,0 +1,849 @@
+from __future__ import absolute_import
+from random import randint
+from math import sqrt, pi, pow
+from sys import exit
+import numpy as np
+
+__all__ = ['Universe', 'ArrayUniverse', 'Point', 'ArrayPoint', 'Vector2D',
+    'ArrayVector2D', 'ChangeFeed', 'Diagnostics', 'Frame']
+
+###################################
+###
+### State Classes
+###
+###################################
+
+class Universe(object):
+    """A collection of points representing the state of the univeres.
+
+    Attributes:
+        _points: list of Points representing state of the Universe.
+        _changes: ChangeFeed of the merges, mass changes and removals of the
+            points (not serialized).
+        _diagnostics: Diagnostics computed by the last evolution policy with
+            diagnostics enabled, or None (not serialized).
+    """
+
+    SIZE = 640 # size (number of pixels in respective dimension) of the screen
+    NOT_STAR_COLOR = (100, 100, 100)  # grey
+    STAR_COLOR = (255,255,0) # yellow
+    BACKGROUND_COLOR = (0, 0, 0) # black
+    BORDER_THICKNESS = 2
+    DENSITY_THRESHOLD = 5000 # above this many points a density map is drawn
+
+    def __init__(self, points):
+        self._points = points
+        self._surface = None
+        self._changes = ChangeFeed()
+        self._diagnostics = None
+
+    def __repr__(self):
+        return "\nUniverse(%s)" % (str(self._points))
+
+    def __getstate__(self):
+        return {'_points': self._points, '_surface': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._changes = ChangeFeed()
+        self._diagnostics = None
+    
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._points = points
+        self._changes.publish(ChangeFeed.RESET)
+
+    @property
+    def changes(self):
+        return self._changes
+
+    @property
+    def diagnostics(self):
+        return self._diagnostics
+
+    @diagnostics.setter
+    def diagnostics(self, diagnostics):
+        self._diagnostics = diagnostics
+
+    def remove(self, point):
+        self._points.remove(point)
+        self._changes.publish(ChangeFeed.REMOVED, point)
+
+    def remove_points(self, points):
+        """Removes all of "points" in one pass over the universe."""
+        removed = set(points)
+        self._points = [point for point in self._points if point not in removed]
+        for point in points:
+            self._changes.publish(ChangeFeed.REMOVED, point)
+
+    def draw(self):
+        """Draws the universe on a screen.
+
+        Renders a hollow circle for each point in points on a black background.
+        If the point is a star it is colored yellow, otherwise the point is
+        colored gray. The circles are cached sprites and only the parts of the
+        screen that changed are updated, see SpriteRenderer. Above
+        DENSITY_THRESHOLD points a density map is drawn instead. At any point
+        the user can press the exit button and the program will exit.
+        """
+        # pygame is only imported once something is drawn, so that headless
+        # simulations do not need it (or a display).
+        from pygame import display, event, quit, QUIT
+        from .rendering import SpriteRenderer
+        if (not self._surface):
+            self._surface = display.set_mode((self.SIZE, self.SIZE))
+            self._renderer = SpriteRenderer(self.DENSITY_THRESHOLD)
+        display.update(self._renderer.draw(self._surface, self.frame()))
+        for e in event.get():
+            if e.type == QUIT:
+                quit()
+                exit(0)
+
+    def close(self):
+        from pygame import quit
+        quit()
+        exit(0)
+
+    def frame(self):
+        """Returns an immutable Frame of what draw() shows of the universe."""
+        return Frame(tuple(point.position.round.tuple for point in self._points), tuple(point.radius for point in self._points), tuple(point.star for point in self._points))
+
+    def kinematics(self):
+        """Returns the kinematic state of the universe as arrays.
+
+        Returns:
+            A tuple (positions, velocities, masses) of float arrays with shapes
+            (n, 2), (n, 2) and (n,), where row i describes points[i]. The
+            arrays are copies; use set_kinematics to write back changes.
+        """
+        n = len(self._points)
+        positions = np.array([point.position.tuple for point in self._points], dtype=float).reshape(n, 2)
+        velocities = np.array([point.velocity.tuple for point in self._points], dtype=float).reshape(n, 2)
+        masses = np.array([point.mass for point in self._points], dtype=float)
+        return positions, velocities, masses
+
+    def set_kinematics(self, positions, velocities):
+        """Writes positions and velocities (as returned by kinematics) back
+        into the points of the universe.
+        """
+        for point, position, velocity in zip(self._points, positions.tolist(), velocities.tolist()):
+            point.position = Vector2D(*position)
+            point.velocity = Vector2D(*velocity)
+
+    def energy(self):
+        """Returns the total energy of the universe, the kinetic energy of the
+        points plus their gravitational potential energy (with the same
+        gravitational constant as the evolution policies).
+        """
+        positions, velocities, masses = self.kinematics()
+        kinetic = 0.5 * np.dot(masses, np.einsum('ij,ij->i', velocities, velocities))
+        potential = 0.0
+        for start in xrange(0, len(positions), 256):
+            stop = min(start + 256, len(positions))
+            diff = positions[start:stop, np.newaxis, :] - positions[np.newaxis, :, :]
+            r = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+            nonzero = r > 0
+            inverse_r = np.zeros_like(r)
+            inverse_r[nonzero] = 1.0 / r[nonzero]
+            # Every pair is visited twice.
+            potential -= 0.5 * np.dot(masses[start:stop], np.dot(inverse_r, masses))
+        return kinetic + potential
+
+    @classmethod
+    def random(cls, number_points):
+        """Generates random universe.
+
+        Generates a list of "number_points" points with attributes that are
+        drawn randomly.
+        """
+        points = []
+        sqrt_size = int(sqrt(Universe.SIZE))
+        for i in xrange(number_points):
+            position = Vector2D(randint(0, Universe.SIZE), randint(0, Universe.SIZE))
+            velocity = Vector2D(randint(-3, 3), randint(-Universe.SIZE / 30, Universe.SIZE / 30))
+            mass = randint(Universe.SIZE / 30, Universe.SIZE)
+            radius = randint(Universe.SIZE / 100, Universe.SIZE / 30)
+            points.append(Point(position, velocity, mass, radius, star=False))
+        return cls(points)
+
+    @classmethod
+    def star_planet_system(cls):
+        """Generates a universe with a central star and a spirally orbiting
+        planet.
+        """
+        star_position = Vector2D(Universe.SIZE / 2)
+        star_velocity = Vector2D.zero()
+        star_mass = Universe.SIZE * 10
+        star_radius = 8
+        star = Point(star_position, star_velocity, star_mass, star_radius, True)
+        planet_1_position = Vector2D(Universe.SIZE / 3.0)
+        planet_1_velocity = Vector2D(4,-4)
+        planet_1_mass = Universe.SIZE/1000
+        planet_1_radius = 2
+        planet_1 = Point(planet_1_position, planet_1_velocity, planet_1_mass, planet_1_radius, False)
+        return cls([star, planet_1])
+
+    @classmethod
+    def static_identical_planets(cls, number_points):
+        """Generates a universe with a "number_points" points with identical 
+        mass and zero velocity.
+        """
+        points = []
+        sqrt_size = int(sqrt(Universe.SIZE))
+        for i in xrange(number_points):
+            position = Vector2D(randint(0, Universe.SIZE), randint(0, Universe.SIZE))
+            velocity = Vector2D.zero()
+            mass = 150
+            radius = 10
+            points.append(Point(position, velocity, mass, radius, star=False))
+        return cls(points)
+
+class ArrayUniverse(Universe):
+    """A universe whose state is stored in contiguous NumPy arrays.
+
+    The points of an ArrayUniverse are ArrayPoint views into the arrays, so
+    code written against the Point API (resolution policies, serialization)
+    keeps working, while vectorized policies operate on the arrays directly.
+
+    Attributes:
+        _positions: (n, 2) float array of position coordinates.
+        _velocities: (n, 2) float array of velocity coordinates.
+        _masses: (n,) float array of masses.
+        _radii: (n,) int array of radii (in pixels).
+        _stars: (n,) bool array of star flags.
+        _points: list of ArrayPoints, _points[i] is a view of row i.
+    """
+
+    def __init__(self, points):
+        self._surface = None
+        self._changes = ChangeFeed()
+        self._diagnostics = None
+        self._load(points)
+
+    def __repr__(self):
+        return "\nArrayUniverse(%s)" % (str(self._points))
+
+    def __getstate__(self):
+        return {'points': [Point(Vector2D(*point.position.tuple), Vector2D(*point.velocity.tuple), point.mass, point.radius, point.star) for point in self._points]}
+
+    def __setstate__(self, state):
+        self._surface = None
+        self._changes = ChangeFeed()
+        self._diagnostics = None
+        self._load(state['points'])
+
+    def _load(self, points):
+        """Replaces the arrays with the state of "points" (which may be views
+        of this universe) and creates fresh views.
+        """
+        n = len(points)
+        positions = np.array([point.position.tuple for point in points], dtype=float).reshape(n, 2)
+        velocities = np.array([point.velocity.tuple for point in points], dtype=float).reshape(n, 2)
+        masses = np.array([point.mass for point in points], dtype=float)
+        radii = np.array([point.radius for point in points], dtype=np.int64)
+        stars = np.array([point.star for point in points], dtype=bool)
+        self._set_arrays(positions, velocities, masses, radii, stars)
+
+    def _set_arrays(self, positions, velocities, masses, radii, stars):
+        self._positions = np.array(positions, dtype=float).reshape(len(positions), 2)
+        self._velocities = np.array(velocities, dtype=float).reshape(len(velocities), 2)
+        self._masses = np.array(masses, dtype=float)
+        self._radii = np.array(radii, dtype=np.int64)
+        self._stars = np.array(stars, dtype=bool)
+        self._points = [ArrayPoint(self, i) for i in xrange(len(self._positions))]
+        self._changes.publish(ChangeFeed.RESET)
+
+    @classmethod
+    def from_arrays(cls, positions, velocities, masses, radii, stars):
+        """Creates a universe holding copies of the given arrays."""
+        universe = cls([])
+        universe._set_arrays(positions, velocities, masses, radii, stars)
+        return universe
+
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._load(points)
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def velocities(self):
+        return self._velocities
+
+    @property
+    def masses(self):
+        return self._masses
+
+    @property
+    def radii(self):
+        return self._radii
+
+    @property
+    def stars(self):
+        return self._stars
+
+    def remove(self, point):
+        """Removes "point" and compacts the arrays. Views of the remaining
+        points stay valid, the view of the removed point does not.
+        """
+        index = point._index
+        self._positions = np.delete(self._positions, index, axis=0)
+        self._velocities = np.delete(self._velocities, index, axis=0)
+        self._masses = np.delete(self._masses, index)
+        self._radii = np.delete(self._radii, index)
+        self._stars = np.delete(self._stars, index)
+        del self._points[index]
+        for view in self._points[index:]:
+            view._index -= 1
+        self._changes.publish(ChangeFeed.REMOVED, point)
+
+    def remove_points(self, points):
+        """Removes all of "points" and compacts the arrays once. Views of the
+        remaining points stay valid, the views of the removed points do not.
+        """
+        keep = np.ones(len(self._points), dtype=bool)
+        keep[[point._index for point in points]] = False
+        self._positions = self._positions[keep]
+        self._velocities = self._velocities[keep]
+        self._masses = self._masses[keep]
+        self._radii = self._radii[keep]
+        self._stars = self._stars[keep]
+        self._points = [view for view in self._points if keep[view._index]]
+        for i, view in enumerate(self._points):
+            view._index = i
+        for point in points:
+            self._changes.publish(ChangeFeed.REMOVED, point)
+
+    def frame(self):
+        positions = self._positions.astype(np.int64)
+        return Frame(tuple(map(tuple, positions.tolist())), tuple(self._radii.tolist()), tuple(self._stars.tolist()))
+
+    def kinematics(self):
+        """Returns the (positions, velocities, masses) arrays themselves, not
+        copies.
+        """
+        return self._positions, self._velocities, self._masses
+
+    def set_kinematics(self, positions, velocities):
+        if positions is not self._positions:
+            self._positions[...] = positions
+        if velocities is not self._velocities:
+            self._velocities[...] = velocities
+
+class Point(object):
+    """Represents a 2D ball in space.
+
+    Attributes:
+        _position: 2D vector of position coordinates.
+        _velocity: 2D vector of velocity coordinates.
+        _mass: mass of ball
+        _radius: radius of ball (in pixels)
+        _star: boolean
+    """
+
+    __slots__ = ('_position', '_velocity', '_mass', '_radius', '_star')
+
+    def __init__(self, position, velocity, mass, radius, star):
+        self._position = position
+        self._velocity = velocity
+        self._mass = mass
+        self._radius = radius
+        self._star = star
+
+    # Classes with __slots__ have no __dict__ for pickle to save.
+    def __getstate__(self):
+        return {'_position': self._position, '_velocity': self._velocity, '_mass': self._mass, '_radius': self._radius, '_star': self._star}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "\nPoint(%s, %s, %d, %d, %d)" % (str(self.position), str(self.velocity), self.mass, self.radius, self.star)
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+
+    @property
+    def velocity(self):
+        return self._velocity
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self._velocity = velocity
+
+    @property
+    def star(self):
+        return self._star
+
+    @star.setter
+    def star(self, star):
+        self._star = star
+
+    @property
+    def mass(self):
+        return self._mass
+
+    @mass.setter
+    def mass(self, mass):
+        self._mass = mass
+
+    @property
+    def radius(self):
+        return self._radius
+
+    @radius.setter
+    def radius(self, radius):
+        self._radius = radius
+
+    @property
+    def area(self):
+        return pi * pow(self.radius, 2)
+
+    @staticmethod
+    def radius_from_area(area):
+        """
+        Args:
+            area: some area.
+
+        Returns:
+            The radius corresponding to the "area".
+        """
+        return int(sqrt(area / pi))
+
+class ArrayPoint(Point):
+    """A Point that is a view of one row of an ArrayUniverse. Reads and writes
+    go straight to the arrays of the universe.
+
+    Attributes:
+        _universe: The ArrayUniverse holding the state.
+        _index: Row of this point in the arrays of "_universe".
+    """
+
+    __slots__ = ('_universe', '_index')
+
+    def __init__(self, universe, index):
+        self._universe = universe
+        self._index = index
+
+    def __reduce__(self):
+        # Pickled as a detached Point, like the points of ArrayUniverse.
+        return (Point, (Vector2D(*self.position.tuple), Vector2D(*self.velocity.tuple), self.mass, self.radius, self.star))
+
+    @property
+    def position(self):
+        return ArrayVector2D(self._universe.positions, self._index)
+
+    @position.setter
+    def position(self, position):
+        self._universe.positions[self._index] = position.tuple
+
+    @property
+    def velocity(self):
+        return ArrayVector2D(self._universe.velocities, self._index)
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self._universe.velocities[self._index] = velocity.tuple
+
+    @property
+    def star(self):
+        return bool(self._universe.stars[self._index])
+
+    @star.setter
+    def star(self, star):
+        self._universe.stars[self._index] = star
+
+    @property
+    def mass(self):
+        return self._universe.masses[self._index].item()
+
+    @mass.setter
+    def mass(self, mass):
+        self._universe.masses[self._index] = mass
+
+    @property
+    def radius(self):
+        return self._universe.radii[self._index].item()
+
+    @radius.setter
+    def radius(self, radius):
+        self._universe.radii[self._index] = radius
+
+class Vector2D(object):
+    """2D vector.
+
+    Attributes:
+        _x: x dimension value.
+        _y: y dimension value.
+        length: l2 length of vector.
+        round: new vector with integer values.
+        tuple: tuple (x,y) 
+    """
+
+    __slots__ = ('_x', '_y')
+
+    def __init__(self, x, y=None):
+        self._x = x
+        # If initialized with one value v set x = y = v.
+        if y is not None:
+            self._y = y
+        else:
+            self._y = x
+
+    def __getstate__(self):
+        return {'_x': self._x, '_y': self._y}
+
+    def __setstate__(self, state):
+        self._x = state['_x']
+        self._y = state['_y']
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+
+    # Overriden operators.
+    # See Vector2DTest.test_operations in test.py for examples.
+    def __repr__(self):
+        return "Vector2D(%s, %s)" % (self.x, self.y)
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y
+
+    def __add__(self, other):
+        return Vector2D(self.x + other.x, self.y + other.y)
+
+    def __sub__(self, other):
+        return Vector2D(self.x - other.x, self.y - other.y)
+
+    def __neg__(self):
+        return Vector2D(-self.x, -self.y)
+
+    def __mul__(self, other):
+        if isinstance(other, (int, float, long)):
+            return Vector2D(self.x * other, self.y * other)
+        return Vector2D(self.x * other.x, self.y * other.y)
+
+    def __div__(self, other):
+        if isinstance(other, (int, float, long)):
+            return Vector2D(self.x / other, self.y / other)
+        return Vector2D(self.x / other.x, self.y / other.y)
+
+    def __mod__(self, other):
+        if isinstance(other, (int, float, long)):
+            return Vector2D(self.x % other, self.y % other)
+        return Vector2D(self.x % other.x, self.y % other.y)
+
+    # In place variants, which mutate (and return) the vector instead of
+    # allocating a new one. Beware of vectors shared between points.
+    def __iadd__(self, other):
+        self.x = self.x + other.x
+        self.y = self.y + other.y
+        return self
+
+    def __isub__(self, other):
+        self.x = self.x - other.x
+        self.y = self.y - other.y
+        return self
+
+    def __imul__(self, other):
+        if isinstance(other, (int, float, long)):
+            self.x = self.x * other
+            self.y = self.y * other
+        else:
+            self.x = self.x * other.x
+            self.y = self.y * other.y
+        return self
+
+    def __idiv__(self, other):
+        if isinstance(other, (int, float, long)):
+            self.x = self.x / other
+            self.y = self.y / other
+        else:
+            self.x = self.x / other.x
+            self.y = self.y / other.y
+        return self
+
+    def add_scaled(self, other, factor):
+        """In place self += other * factor, without a temporary vector."""
+        self.x = self.x + other.x * factor
+        self.y = self.y + other.y * factor
+        return self
+
+    def set(self, x, y):
+        self.x = x
+        self.y = y
+        return self
+
+    @property
+    def length(self):
+        return sqrt(pow(self.x, 2) + pow(self.y, 2))
+
+    @property
+    def round(self):
+        return Vector2D(int(self.x), int(self.y))
+
+    @property
+    def tuple(self):
+        return (self.x, self.y)
+
+    @staticmethod
+    def zero():
+        return Vector2D(0.0,0.0)
+
+class ArrayVector2D(Vector2D):
+    """2D vector that is a view of row "_index" of an (n, 2) array.
+
+    Attributes:
+        _array: (n, 2) array holding the coordinates.
+        _index: row of the array.
+    """
+
+    __slots__ = ('_array', '_index')
+
+    def __init__(self, array, index):
+        self._array = array
+        self._index = index
+
+    def __reduce__(self):
+        return (Vector2D, self.tuple)
+
+    @property
+    def x(self):
+        return self._array[self._index, 0].item()
+
+    @property
+    def y(self):
+        return self._array[self._index, 1].item()
+
+    @x.setter
+    def x(self, value):
+        self._array[self._index, 0] = value
+
+    @y.setter
+    def y(self, value):
+        self._array[self._index, 1] = value
+
+class ChangeFeed(object):
+    """Log of the changes made to the points of a universe, so that policies
+    can do work proportional to what changed instead of to the number of
+    points.
+
+    Events are (kind, point, other) tuples:
+        (MERGED, survivor, absorbed): "absorbed" was merged into "survivor".
+        (MASS_CHANGED, point, None): the mass of "point" changed.
+        (REMOVED, point, None): "point" was removed from the universe.
+        (RESET, None, None): the points were replaced, everything changed.
+
+    Each subscriber has a cursor into the log and read() returns the events
+    published since its last read. Events are only kept while a subscriber
+    has not read them, and not recorded at all without subscribers.
+
+    Attributes:
+        _events: list of the unread events.
+        _start: Position of _events[0] in the log.
+        _cursors: dict of subscription to position of its next event.
+        _next_subscription: Identifier of the next subscription.
+    """
+
+    MERGED = 'merged'
+    MASS_CHANGED = 'mass_changed'
+    REMOVED = 'removed'
+    RESET = 'reset'
+
+    def __init__(self):
+        self._events = []
+        self._start = 0
+        self._cursors = {}
+        self._next_subscription = 0
+
+    def __len__(self):
+        """Number of events kept."""
+        return len(self._events)
+
+    def subscribe(self):
+        """Returns a subscription that reads the events published from now
+        on.
+        """
+        subscription = self._next_subscription
+        self._next_subscription += 1
+        self._cursors[subscription] = self._start + len(self._events)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        del self._cursors[subscription]
+        self._compact()
+
+    def publish(self, kind, point=None, other=None):
+        if self._cursors:
+            self._events.append((kind, point, other))
+
+    def pending(self, subscription):
+        """Number of events "subscription" has not read."""
+        return self._start + len(self._events) - self._cursors[subscription]
+
+    def read(self, subscription):
+        """Returns the list of events published since the last read of
+        "subscription", oldest first.
+        """
+        events = self._events[self._cursors[subscription] - self._start:]
+        self._cursors[subscription] = self._start + len(self._events)
+        self._compact()
+        return events
+
+    def _compact(self):
+        """Drops the events every subscriber has read."""
+        read = min(self._cursors.values()) if self._cursors else self._start + len(self._events)
+        if read > self._start:
+            del self._events[:read - self._start]
+            self._start = read
+
+class Diagnostics(object):
+    """Conserved quantities of a universe: energy, momentum and angular
+    momentum (about the origin).
+
+    Evolution policies with diagnostics enabled compute them as a by-product
+    of their force pass and store them as the diagnostics of the universe.
+
+    Attributes:
+        _kinetic: Kinetic energy.
+        _potential: Gravitational potential energy.
+        _momentum: (x, y) total momentum.
+        _angular_momentum: Total angular momentum.
+    """
+
+    __slots__ = ('_kinetic', '_potential', '_momentum', '_angular_momentum')
+
+    def __init__(self, kinetic, potential, momentum, angular_momentum):
+        self._kinetic = kinetic
+        self._potential = potential
+        self._momentum = momentum
+        self._angular_momentum = angular_momentum
+
+    @classmethod
+    def from_arrays(cls, positions, velocities, masses, potentials):
+        """Computes the diagnostics of points with the given (n, 2) positions
+        and velocities, (n,) masses and (n,) gravitational potentials.
+        """
+        kinetic = 0.5 * np.dot(masses, np.einsum('ij,ij->i', velocities, velocities))
+        # Every pair is counted in the potential of both of its points.
+        potential = 0.5 * np.dot(masses, potentials)
+        momentum = np.dot(masses, velocities).reshape(2)
+        angular_momentum = np.dot(masses, positions[:, 0] * velocities[:, 1] - positions[:, 1] * velocities[:, 0])
+        return cls(float(kinetic), float(potential), (float(momentum[0]), float(momentum[1])), float(angular_momentum))
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in Diagnostics.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "\nDiagnostics(kinetic=%r, potential=%r, momentum=%r, angular_momentum=%r)" % (self._kinetic, self._potential, self._momentum, self._angular_momentum)
+
+    @property
+    def kinetic(self):
+        return self._kinetic
+
+    @property
+    def potential(self):
+        return self._potential
+
+    @property
+    def energy(self):
+        return self._kinetic + self._potential
+
+    @property
+    def momentum(self):
+        return self._momentum
+
+    @property
+    def angular_momentum(self):
+        return self._angular_momentum
+
+class Frame(object):
+    """Immutable snapshot of what is drawn of a universe, see Universe.frame.
+
+    Attributes:
+        _positions: tuple of integer (x, y) positions of the points.
+        _radii: tuple of the radii of the points.
+        _stars: tuple of the star flags of the points.
+    """
+
+    __slots__ = ('_positions', '_radii', '_stars')
+
+    def __init__(self, positions, radii, stars):
+        self._positions = positions
+        self._radii = radii
+        self._stars = stars
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in Frame.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def radii(self):
+        return self._radii
+
+    @property
+    def stars(self):
+        return self._stars
+
+    def to_array(self):
+        """Renders the frame offscreen, without a display.
+
+        Returns:
+            (SIZE, SIZE, 3) uint8 array of the RGB pixels, indexed by row.
+        """
+        from pygame import Surface, surfarray
+        surface = Surface((Universe.SIZE, Universe.SIZE))
+        self.render(surface)
+        return surfarray.array3d(surface).transpose(1, 0, 2)
+
+    def render(self, surface):
+        """Draws a black background which overwrites "surface", then a hollow
+        circle for each point, yellow for stars and grey otherwise.
+        """
+        from pygame import draw
+        surface.fill(Universe.BACKGROUND_COLOR)
+        for position, radius, star in zip(self._positions, self._radii, self._stars):
+            color = Universe.STAR_COLOR if star else Universe.NOT_STAR_COLOR
+            draw.circle(surface, color, position, radius, Universe.BORDER_THICKNESS)
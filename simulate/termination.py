@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+
+__all__ = ['Iterations', 'EnergyDrift', 'FirstOf']
+
+###################################
+###
+### Termination Conditions
+###
+###################################
+
+class Iterations(object):
+    """Terminates simulation after "limit" iterations.
+
+    Attributes:
+        _limit: Limit number of iterations.
+        _iteration: Number of iterations already completed.
+    """
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._iteration = 0
+
+    def keep_running(self, universe):
+        if (self._iteration >= self._limit):
+            return False
+        self._iteration += 1
+        return True
+
+    def __repr__(self):
+        return "\nIterations(%r)" % (self._limit)
+
+class EnergyDrift(object):
+    """Terminates simulation once the total energy drifted from the first
+    energy seen by more than "tolerance", relative to it.
+
+    The energy is read from the diagnostics of the universe, so an evolution
+    policy has to compute them: every gravity evolution policy does when
+    created with diagnostics=True. Those of BarnesHutGravityEvolution,
+    ParticleMeshGravityEvolution and TiledGravityEvolution carry their
+    approximation error, so the tolerance should be above it. If the
+    universe still has no diagnostics after the first step, a ValueError is
+    raised rather than running unchecked. Combine it with Iterations through
+    FirstOf to also bound the run.
+
+    Attributes:
+        _tolerance: Largest allowed relative drift |E - E_0| / |E_0|.
+        _reference: The first energy seen E_0, or None.
+        _drift: Relative drift of the last energy seen.
+        _checks: Number of times the condition was asked.
+    """
+
+    def __init__(self, tolerance):
+        self._tolerance = tolerance
+        self._reference = None
+        self._drift = 0.0
+        self._checks = 0
+
+    def __setstate__(self, state):
+        self._checks = 0
+        self.__dict__.update(state)
+
+    @property
+    def drift(self):
+        return self._drift
+
+    def keep_running(self, universe):
+        diagnostics = universe.diagnostics
+        self._checks += 1
+        if diagnostics is None:
+            # The first check comes before any step had a chance to compute them.
+            if self._checks > 1:
+                raise ValueError("EnergyDrift needs the diagnostics of the universe, enable them in the evolution policy")
+            return True
+        if self._reference is None:
+            self._reference = diagnostics.energy
+        if self._reference:
+            self._drift = abs(diagnostics.energy - self._reference) / abs(self._reference)
+        return self._drift <= self._tolerance
+
+    def __repr__(self):
+        return "\nEnergyDrift(%r)" % (self._tolerance)
+
+class FirstOf(object):
+    """Terminates simulation as soon as any of "conditions" does. Every
+    condition is asked on every iteration, so that they all keep count.
+
+    Attributes:
+        _conditions: list of termination conditions.
+    """
+
+    def __init__(self, conditions):
+        self._conditions = conditions
+
+    def __getstate__(self):
+        # Imported once needed, so that termination does not load
+        # serialization.
+        from .serialization import Serialize
+        return {'conditions': [Serialize.object_schema(condition) for condition in self._conditions]}
+
+    def __setstate__(self, state):
+        from .serialization import Serialize
+        self._conditions = [Serialize.object_from_schema(condition) for condition in state['conditions']]
+
+    def keep_running(self, universe):
+        return all([condition.keep_running(universe) for condition in self._conditions])
+
+    def __repr__(self):
+        return "\nFirstOf(%s)" % (str(self._conditions))
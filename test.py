@@ -1,7 +1,17 @@
 import simulate
-from unittest import TestCase, main
-from math import sqrt
-from os import remove   
+import benchmark
+from unittest import TestCase, main, skipIf
+from math import sqrt, erfc
+from os import environ, remove, listdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from random import seed, random
+from json import loads
+from time import sleep, time
+from pickle import dumps, loads as unpickle
+import numpy as np
+from pygame import Surface, surfarray
 
 class Factory(object):
     """A collection of static methods that generate standard instances used throughout tests.
@@ -39,6 +49,12 @@ class Factory(object):
         planet_2 = simulate.Point(position_2, velocity_2, mass_2, radius_2, False)
         return simulate.Universe([planet_1, planet_2])
 
+    @staticmethod
+    def get_orbit_universe():
+        star = simulate.Point(simulate.Vector2D.zero(), simulate.Vector2D.zero(), 1000, 1, True)
+        planet = simulate.Point(simulate.Vector2D(100, 0), simulate.Vector2D(0, sqrt(10)), 1, 1, False)
+        return simulate.Universe([star, planet])
+
 class Vector2DTest(TestCase):
     
     def setUp(self):
@@ -66,6 +82,21 @@ class Vector2DTest(TestCase):
         self.assertEqual(self.v7, self.v1 % 3)
         self.assertEqual(self.v7, self.v1 % self.v8)
 
+    def test_in_place_operations(self):
+        v = simulate.Vector2D(4, 2)
+        alias = v
+        v += self.v2
+        self.assertTrue(v is alias)
+        self.assertEqual(simulate.Vector2D(6, 3), v)
+        v -= self.v2
+        v *= 2
+        self.assertEqual(simulate.Vector2D(8, 4), v)
+        v /= self.v1
+        self.assertEqual(self.v4, v)
+        self.assertEqual(simulate.Vector2D(6, 6), v.add_scaled(self.v4, 2))
+        self.assertEqual(simulate.Vector2D(1, 2), v.set(1, 2))
+        self.assertFalse(hasattr(v, '__dict__'))
+
 
 class PointTest(TestCase):
 
@@ -82,6 +113,7 @@ class PointTest(TestCase):
         self.assertEqual(radius, point.radius)
         self.assertEqual(star, point.star)
         self.assertAlmostEqual(78.53981633, point.area)
+        self.assertFalse(hasattr(point, '__dict__'))
 
     def test_radius_from_area(self):
         self.assertEqual(5, simulate.Point.radius_from_area(78.6))
@@ -96,6 +128,43 @@ class UniverseTest(TestCase):
     def test_draw(self):
         Factory.get_simple_universe().draw()
 
+    def test_pickle(self):
+        for universe in (Factory.get_simple_universe(), simulate.ArrayUniverse(Factory.get_simple_universe().points)):
+            unpickled = unpickle(dumps(universe, 0))
+            self.assertEqual(type(universe), type(unpickled))
+            self.assertEqual(str(universe), str(unpickled))
+            self.assertEqual(simulate.Vector2D, type(unpickle(dumps(universe.points[1].position, 0))))
+
+class ArrayUniverseTest(TestCase):
+
+    def test_views(self):
+        universe = simulate.ArrayUniverse(Factory.get_simple_universe().points)
+        point = universe.points[1]
+        self.assertEqual(simulate.Vector2D(2, 2), point.position)
+        point.position = simulate.Vector2D(3, 4)
+        point.velocity.x = 7
+        point.mass = 12
+        self.assertEqual([3, 4], universe.positions[1].tolist())
+        self.assertEqual([7, 2], universe.velocities[1].tolist())
+        self.assertEqual(12, universe.masses[1])
+
+    def test_remove(self):
+        universe = simulate.ArrayUniverse(Factory.get_simple_universe().points)
+        last = universe.points[2]
+        universe.remove(universe.points[0])
+        self.assertEqual(2, len(universe.points))
+        self.assertEqual(2, len(universe.positions))
+        self.assertEqual(simulate.Vector2D(20, 20), last.position)
+
+    def test_policies(self):
+        universe = simulate.ArrayUniverse(Factory.get_simple_universe().points)
+        simulate.MergeCollision().resolve(universe)
+        simulate.StarFormation(15).resolve(universe)
+        self.assertEqual(2, len(universe.positions))
+        self.assertEqual([True, False], universe.stars.tolist())
+        decoded = simulate.Serialize.decode(simulate.Serialize.encode(universe))
+        self.assertEqual(str(universe), str(decoded))
+
 class StarFormationTest(TestCase):
     
     def test_not_star_formation(self):
@@ -112,6 +181,56 @@ class StarFormationTest(TestCase):
         for point in universe.points:
             self.assertEqual(point.star, False)
 
+    def test_incremental(self):
+        star_formation = simulate.StarFormation(15)
+        universe = Factory.get_simple_universe()
+        star_formation.resolve(universe)
+        # Changed without an event, so only a full scan notices it.
+        universe.points[2].mass = 30
+        simulate.MergeCollision().resolve(universe)
+        star_formation.resolve(universe)
+        self.assertEqual([True, False], [point.star for point in universe.points])
+        self.assertEqual(0, len(universe.changes))
+        simulate.StarFormation(15, incremental=False).resolve(universe)
+        self.assertEqual([True, True], [point.star for point in universe.points])
+
+    def test_incremental_array_universe(self):
+        seed(2)
+        universe = simulate.ArrayUniverse.random(300)
+        expected = simulate.ArrayUniverse(universe.points)
+        for current in (universe, expected):
+            star_formation = simulate.StarFormation(50, incremental=current is universe)
+            for i in xrange(3):
+                simulate.EulerMethodGravityEvolution().evolve(current)
+                simulate.MergeCollision().resolve(current)
+                star_formation.resolve(current)
+        self.assertEqual([point.star for point in expected.points], universe.stars.tolist())
+
+class ChangeFeedTest(TestCase):
+
+    def test_cursors(self):
+        feed = simulate.ChangeFeed()
+        feed.publish(simulate.ChangeFeed.RESET)
+        first = feed.subscribe()
+        feed.publish(simulate.ChangeFeed.MASS_CHANGED, 1)
+        second = feed.subscribe()
+        feed.publish(simulate.ChangeFeed.REMOVED, 2)
+        self.assertEqual([(simulate.ChangeFeed.MASS_CHANGED, 1, None), (simulate.ChangeFeed.REMOVED, 2, None)], feed.read(first))
+        self.assertEqual(1, feed.pending(second))
+        self.assertEqual([(simulate.ChangeFeed.REMOVED, 2, None)], feed.read(second))
+        self.assertEqual(0, len(feed))
+        self.assertEqual([], feed.read(first))
+
+    def test_remove_points(self):
+        universe = simulate.ArrayUniverse(Factory.get_simple_universe().points)
+        subscription = universe.changes.subscribe()
+        first, second, third = universe.points
+        universe.remove_points([first, third])
+        self.assertEqual([second], universe.points)
+        self.assertEqual(0, second._index)
+        self.assertEqual([[2, 2]], universe.positions.tolist())
+        self.assertEqual([simulate.ChangeFeed.REMOVED] * 2, [kind for kind, point, other in universe.changes.read(subscription)])
+
 class MergeCollisionTest(TestCase):
     
     def test_merge_collision(self):
@@ -119,7 +238,124 @@ class MergeCollisionTest(TestCase):
         universe = Factory.get_simple_universe()
         merge_collision.resolve(universe)
         self.assertEqual(2, len(universe.points))
+
+    def test_conservation(self):
+        seed(4)
+        universe = simulate.Universe.random(300)
+        mass = sum(point.mass for point in universe.points)
+        momentum = sum(point.velocity.x * point.mass for point in universe.points)
+        simulate.MergeCollision().resolve(universe)
+        self.assertTrue(len(universe.points) < 300)
+        self.assertAlmostEqual(mass, sum(point.mass for point in universe.points))
+        self.assertAlmostEqual(momentum, sum(point.velocity.x * point.mass for point in universe.points))
+        for i, p1 in enumerate(universe.points):
+            for p2 in universe.points[i + 1:]:
+                self.assertTrue((p1.position - p2.position).length >= p1.radius + p2.radius)
         
+class ClusterMergeCollisionTest(TestCase):
+
+    def test_merge_collision(self):
+        universe = Factory.get_simple_universe()
+        simulate.ClusterMergeCollision().resolve(universe)
+        self.assertEqual(2, len(universe.points))
+        self.assertEqual(20, universe.points[0].mass)
+        self.assertEqual(7, universe.points[0].radius)
+
+    def test_order_independence(self):
+        seed(5)
+        points = simulate.Universe.random(300).points
+        universes = [simulate.Universe(list(points)), simulate.Universe(list(reversed(points)))]
+        states = []
+        for universe in universes:
+            mass = sum(point.mass for point in universe.points)
+            universe.points = [simulate.Point(p.position, p.velocity, p.mass, p.radius, p.star) for p in universe.points]
+            simulate.ClusterMergeCollision().resolve(universe)
+            self.assertAlmostEqual(mass, sum(point.mass for point in universe.points))
+            states.append(sorted(str(point) for point in universe.points))
+        self.assertTrue(len(states[0]) < 300)
+        self.assertEqual(states[0], states[1])
+
+    def test_large_collapse(self):
+        points = [simulate.Point(simulate.Vector2D(i % 50, i // 50), simulate.Vector2D.zero(), 1, 2, False) for i in xrange(2500)]
+        universe = simulate.Universe(points)
+        simulate.ClusterMergeCollision().resolve(universe)
+        self.assertEqual(1, len(universe.points))
+        self.assertEqual(2500, universe.points[0].mass)
+        self.assertEqual(100, universe.points[0].radius)
+
+class TiledMergeCollisionTest(TestCase):
+
+    def get_states(self, universe_class, points, collision):
+        universe = universe_class([simulate.Point(p.position, p.velocity, p.mass, p.radius, p.star) for p in points])
+        subscription = universe.changes.subscribe()
+        collision.resolve(universe)
+        merges = len(universe.changes.read(subscription))
+        return [str(point) for point in universe.points], merges
+
+    def test_matches_merge_collision(self):
+        seed(7)
+        points = simulate.Universe.random(600).points
+        # A chain across the corner of four tiles.
+        points += [simulate.Point(simulate.Vector2D(150 + 5 * i, 150 + 5 * i), simulate.Vector2D.zero(), 10, 4, False) for i in xrange(5)]
+        collision = simulate.TiledMergeCollision(tiles=4, processes=2)
+        try:
+            for universe_class in (simulate.Universe, simulate.ArrayUniverse):
+                expected = self.get_states(universe_class, points, simulate.MergeCollision())
+                actual = self.get_states(universe_class, points, collision)
+                self.assertTrue(len(expected[0]) < len(points))
+                self.assertEqual(expected, actual)
+        finally:
+            collision.close()
+
+    def test_large_radius_falls_back(self):
+        universe = Factory.get_simple_universe()
+        universe.points[2].radius = 100
+        collision = simulate.TiledMergeCollision(tiles=4, processes=1)
+        collision.resolve(universe)
+        self.assertEqual(1, len(universe.points))
+        self.assertEqual(30, universe.points[0].mass)
+
+class SweptMergeCollisionTest(TestCase):
+
+    def get_crossing_universe(self):
+        points = [simulate.Point(simulate.Vector2D(0.0, 0.0), simulate.Vector2D(20.0, 0.0), 1.0, 1, False),
+            simulate.Point(simulate.Vector2D(10.0, 0.0), simulate.Vector2D(-20.0, 0.0), 3.0, 1, False),
+            simulate.Point(simulate.Vector2D(0.0, 50.0), simulate.Vector2D(0.0, 0.0), 1.0, 1, False)]
+        return simulate.Universe(points)
+
+    def move(self, universe):
+        for point in universe.points:
+            point.position = point.position + point.velocity
+
+    def test_merge_collision(self):
+        universe = Factory.get_simple_universe()
+        simulate.SweptMergeCollision().resolve(universe)
+        self.assertEqual(2, len(universe.points))
+
+    def test_no_tunneling(self):
+        universe = self.get_crossing_universe()
+        collision = simulate.SweptMergeCollision()
+        collision.resolve(universe)
+        self.move(universe)
+        simulate.MergeCollision().resolve(universe)
+        self.assertEqual(3, len(universe.points))
+        collision.resolve(universe)
+        self.assertEqual(2, len(universe.points))
+        merged = universe.points[0]
+        self.assertEqual(4.0, merged.mass)
+        self.assertEqual(simulate.Vector2D(-10.0, 0.0), merged.velocity)
+        # The center of mass of the end positions (20, 0) and (-10, 0).
+        self.assertEqual(simulate.Vector2D(-2.5, 0.0), merged.position)
+
+    def test_serialize(self):
+        universe = self.get_crossing_universe()
+        collision = simulate.SweptMergeCollision()
+        collision.resolve(universe)
+        collision = simulate.Serialize.decode(simulate.Serialize.encode(collision))
+        self.move(universe)
+        collision.resolve(universe)
+        self.assertEqual(2, len(universe.points))
+
 class IterationsTest(TestCase):
     
     def test_iterations(self):
@@ -131,8 +367,106 @@ class IterationsTest(TestCase):
             i += 1
         self.assertFalse(iterations.keep_running(universe))
 
+class EnergyDriftTest(TestCase):
+
+    def get_simulator(self, evolution):
+        return simulate.Simulator([evolution], [], Factory.get_orbit_universe(), simulate.FirstOf([simulate.Iterations(1000), simulate.EnergyDrift(1e-3)]), simulate.Headless())
+
+    def test_stops_diverged_run(self):
+        simulator = self.get_simulator(simulate.VectorizedGravityEvolution(t=2, diagnostics=True))
+        simulator.run()
+        self.assertTrue(simulator._iteration < 1000)
+        self.assertTrue(simulator._termination_condition._conditions[1].drift > 1e-3)
+
+    def test_keeps_stable_run(self):
+        simulator = self.get_simulator(simulate.LeapfrogGravityEvolution(t=2, diagnostics=True))
+        simulator.run()
+        self.assertEqual(1000, simulator._iteration)
+
+    def test_missing_diagnostics(self):
+        simulator = self.get_simulator(simulate.BarnesHutGravityEvolution())
+        with self.assertRaises(ValueError):
+            simulator.run()
+        self.assertEqual(1, simulator._iteration)
+
+    def test_serialize(self):
+        simulator = self.get_simulator(simulate.LeapfrogGravityEvolution(diagnostics=True))
+        file_name = 'drift.gsim'
+        simulate.Serialize.to_snapshot(simulator, file_name)
+        for decoded in (simulate.Serialize.from_snapshot(file_name), simulate.Serialize.decode(simulate.Serialize.encode(simulator))):
+            self.assertEqual(str(simulator._evolution_policies), str(decoded._evolution_policies))
+            self.assertEqual(str(simulator._termination_condition), str(decoded._termination_condition))
+        remove(file_name)
+
+class DiagnosticsTest(TestCase):
+
+    def test_fused_energy(self):
+        seed(9)
+        universe = simulate.ArrayUniverse.random(50)
+        universe.positions[...] += np.random.RandomState(0).rand(50, 2)
+        energy = universe.energy()
+        simulate.VectorizedGravityEvolution(tile_size=16, diagnostics=True).evolve(universe)
+        self.assertAlmostEqual(1.0, universe.diagnostics.energy / energy)
+        simulate.LeapfrogGravityEvolution(diagnostics=True).evolve(universe)
+        self.assertAlmostEqual(1.0, universe.diagnostics.energy / universe.energy())
+
+    def test_euler_matches_vectorized(self):
+        universe = Factory.get_orbit_universe()
+        simulate.EulerMethodGravityEvolution(diagnostics=True).evolve(universe)
+        euler = universe.diagnostics
+        universe = Factory.get_orbit_universe()
+        simulate.VectorizedGravityEvolution(diagnostics=True).evolve(universe)
+        vectorized = universe.diagnostics
+        self.assertAlmostEqual(euler.potential, vectorized.potential)
+        self.assertAlmostEqual(-10.0, euler.potential)
+        self.assertAlmostEqual(5.0, euler.kinetic)
+        self.assertEqual((0.0, sqrt(10)), euler.momentum)
+        self.assertAlmostEqual(100 * sqrt(10), euler.angular_momentum)
+
+    def test_other_policies(self):
+        seed(4)
+        reference = simulate.ArrayUniverse.random(200)
+        simulate.VectorizedGravityEvolution(diagnostics=True).evolve(reference)
+        exact = [simulate.ParallelGravityEvolution(processes=2, diagnostics=True), simulate.CompiledGravityEvolution(diagnostics=True),
+            simulate.TiledGravityEvolution(tiles=1, processes=2, diagnostics=True)]
+        approximate = [simulate.BarnesHutGravityEvolution(diagnostics=True), simulate.ParticleMeshGravityEvolution(diagnostics=True),
+            simulate.TiledGravityEvolution(processes=2, diagnostics=True)]
+        for places, policies in ((7, exact), (2, approximate)):
+            for policy in policies:
+                seed(4)
+                universe = simulate.ArrayUniverse.random(200)
+                try:
+                    policy.evolve(universe)
+                finally:
+                    if hasattr(policy, 'close'):
+                        policy.close()
+                self.assertAlmostEqual(1.0, universe.diagnostics.potential / reference.diagnostics.potential, places, policy)
+                self.assertAlmostEqual(reference.diagnostics.kinetic, universe.diagnostics.kinetic)
+
+    def test_pickle(self):
+        diagnostics = simulate.Diagnostics(5.0, -10.0, (0.0, 1.0), 2.0)
+        self.assertEqual(str(diagnostics), str(unpickle(dumps(diagnostics, 0))))
+
 class SerializeTest(TestCase):
 
+    # A Simulator encoded before the policies had __getstate__.
+    LEGACY_JSONPICKLE = ('{"py/object": "simulate.Simulator", '
+        '"_evolution_policies": [{"py/object": "simulate.EulerMethodGravityEvolution", "_t": 1}], '
+        '"_resolution_policies": [{"py/object": "simulate.MergeCollision"}, {"py/object": "simulate.StarFormation", "_threshold_mass": 500}], '
+        '"_termination_condition": {"py/object": "simulate.Iterations", "_limit": 2, "_iteration": 0}, '
+        '"_universe": {"py/object": "simulate.Universe", "_surface": null, "_points": ['
+        '{"py/object": "simulate.Point", "_star": true, "_velocity": {"py/object": "simulate.Vector2D", "_y": 0.0, "_x": 0.0}, '
+        '"_mass": 6400, "_radius": 8, "_position": {"py/object": "simulate.Vector2D", "_y": 320, "_x": 320}}, '
+        '{"py/object": "simulate.Point", "_star": false, "_velocity": {"py/object": "simulate.Vector2D", "_y": -4, "_x": 4}, '
+        '"_mass": 0, "_radius": 2, "_position": {"py/object": "simulate.Vector2D", "_y": 213.33333333333334, "_x": 213.33333333333334}}]}}')
+
+    def test_legacy_jsonpickle(self):
+        simulator = simulate.Serialize.decode(SerializeTest.LEGACY_JSONPICKLE)
+        simulator._render_policy = simulate.Headless()
+        simulator.run()
+        self.assertEqual(2, simulator.iteration)
+        self.assertEqual(2, len(simulator.universe.points))
+
     def test_serialization(self):
         before = Factory.get_simulator()
         file_name = 'simulator.txt'
@@ -141,6 +475,28 @@ class SerializeTest(TestCase):
         self.assertEqual(str(before), str(after))
         remove(file_name)
 
+    def test_snapshot(self):
+        file_name = 'simulator.snapshot'
+        before = simulate.Simulator([simulate.LeapfrogGravityEvolution(t=0.5), simulate.BarnesHutGravityEvolution(theta=0.7)], [simulate.MergeCollision(), simulate.StarFormation(300)], simulate.ArrayUniverse.random(20), simulate.Iterations(10), simulate.RenderCadence(every=5))
+        before._termination_condition.keep_running(before.universe)
+        simulate.Serialize.to_snapshot(before, file_name)
+        after = simulate.Serialize.from_snapshot(file_name)
+        self.assertEqual(str(before), str(after))
+        self.assertEqual(1, after._termination_condition._iteration)
+        remove(file_name)
+
+    def test_map_snapshot(self):
+        file_name = 'universe.snapshot'
+        before = simulate.Universe([simulate.Point(simulate.Vector2D(i + 0.5, 2.0 * i), simulate.Vector2D.zero(), 1.0, i, i % 2 == 0) for i in xrange(20)])
+        simulate.Serialize.to_snapshot(before, file_name)
+        snapshot = simulate.Serialize.map_snapshot(file_name)
+        self.assertEqual(20, snapshot.count)
+        self.assertEqual([[i + 0.5, 2.0 * i] for i in xrange(20)], snapshot.positions.tolist())
+        self.assertEqual(range(20), snapshot.radii.tolist())
+        self.assertEqual(str(before), str(simulate.Serialize.from_snapshot(file_name)))
+        del snapshot
+        remove(file_name)
+
 class EulerMethodGravityEvolutionTest(TestCase):
 
     def test_evolution(self):
@@ -152,13 +508,670 @@ class EulerMethodGravityEvolutionTest(TestCase):
         print (universe.points[0].position - universe.points[1].position).length
         self.assertAlmostEqual(3.748, (universe.points[0].position - universe.points[1].position).length, 3)
 
+    def test_evolution_in_place(self):
+        universe = Factory.get_simple_universe()
+        points = list(universe.points)
+        expected = simulate.ArrayUniverse(points)
+        simulate.EulerMethodGravityEvolution().evolve(universe)
+        simulate.VectorizedGravityEvolution().evolve(expected)
+        self.assertTrue(all(a is b for a, b in zip(points, universe.points)))
+        # The points shared a velocity vector, each must have been updated once.
+        self.assertEqual(3, len(set(id(point.velocity) for point in points)))
+        for point, velocity in zip(points, expected.velocities.tolist()):
+            self.assertAlmostEqual(velocity[0], point.velocity.x)
+            self.assertAlmostEqual(velocity[1], point.velocity.y)
+
+class VectorizedGravityEvolutionTest(TestCase):
+
+    def test_evolution(self):
+        universe = simulate.ArrayUniverse(Factory.get_evolve_universe().points)
+        evolution = simulate.VectorizedGravityEvolution()
+        evolution.evolve(universe)
+        self.assertAlmostEqual(3.9375, (universe.points[0].position - universe.points[1].position).length)
+        evolution.evolve(universe)
+        self.assertAlmostEqual(3.748, (universe.points[0].position - universe.points[1].position).length, 3)
+
+    def test_matches_euler(self):
+        seed(1)
+        points = simulate.Universe.random(30).points
+        expected = simulate.Universe(points)
+        actual = simulate.ArrayUniverse(points)
+        simulate.EulerMethodGravityEvolution().evolve(expected)
+        simulate.VectorizedGravityEvolution(tile_size=7).evolve(actual)
+        expected_positions = sorted(point.position.tuple for point in expected.points)
+        actual_positions = sorted(point.position.tuple for point in actual.points)
+        for e, a in zip(expected_positions, actual_positions):
+            self.assertAlmostEqual(e[0], a[0])
+            self.assertAlmostEqual(e[1], a[1])
+
+class LeapfrogGravityEvolutionTest(TestCase):
+
+    def test_evolution(self):
+        universe = Factory.get_evolve_universe()
+        simulate.LeapfrogGravityEvolution().evolve(universe)
+        self.assertAlmostEqual(3.9375, (universe.points[0].position - universe.points[1].position).length)
+
+    def get_energy_drift(self, evolution, steps):
+        universe = Factory.get_orbit_universe()
+        energy = universe.energy()
+        drift = 0
+        for i in xrange(steps):
+            evolution.evolve(universe)
+            drift = max(drift, abs((universe.energy() - energy) / energy))
+        return drift
+
+    def test_bounded_energy_drift(self):
+        # Ten orbits at 100 steps per orbit.
+        leapfrog_drift = self.get_energy_drift(simulate.LeapfrogGravityEvolution(t=2), 1000)
+        euler_drift = self.get_energy_drift(simulate.VectorizedGravityEvolution(t=2), 1000)
+        self.assertTrue(leapfrog_drift < 1e-3)
+        self.assertTrue(euler_drift > 100 * leapfrog_drift)
+
+class BlockTimestepGravityEvolutionTest(TestCase):
+
+    def get_encounter_universe(self):
+        # A planet on an eccentric orbit skimming the star, and far, slow
+        # points that do not need small steps.
+        star = simulate.Point(simulate.Vector2D.zero(), simulate.Vector2D.zero(), 1000, 1, True)
+        planet = simulate.Point(simulate.Vector2D(100, 0), simulate.Vector2D(0, 1), 1, 1, False)
+        far = [simulate.Point(simulate.Vector2D(5000 + 100 * i, 5000), simulate.Vector2D.zero(), 1, 1, False) for i in xrange(8)]
+        return simulate.ArrayUniverse([star, planet] + far)
+
+    def get_energy_drift(self, evolution, steps):
+        universe = self.get_encounter_universe()
+        energy = universe.energy()
+        drift = 0
+        for i in xrange(steps):
+            evolution.evolve(universe)
+            drift = max(drift, abs((universe.energy() - energy) / energy))
+        return drift
+
+    def test_reduces_to_leapfrog(self):
+        expected = simulate.ArrayUniverse(Factory.get_orbit_universe().points)
+        actual = simulate.ArrayUniverse(Factory.get_orbit_universe().points)
+        leapfrog = simulate.LeapfrogGravityEvolution(t=2)
+        block = simulate.BlockTimestepGravityEvolution(t=2, max_level=0)
+        for i in xrange(50):
+            leapfrog.evolve(expected)
+            block.evolve(actual)
+        self.assertTrue(np.allclose(expected.positions, actual.positions))
+        self.assertTrue(np.allclose(expected.velocities, actual.velocities))
+
+    def test_close_encounter(self):
+        evolution = simulate.BlockTimestepGravityEvolution(t=2, max_level=8)
+        block_drift = self.get_energy_drift(evolution, 100)
+        leapfrog_drift = self.get_energy_drift(simulate.LeapfrogGravityEvolution(t=2), 100)
+        self.assertTrue(block_drift < 1e-3)
+        self.assertTrue(leapfrog_drift > 10 * block_drift)
+        # The far points stay at level 0.
+        self.assertTrue(evolution.level_counts[0] >= 8)
+        self.assertEqual(10, sum(evolution.level_counts[level] / 2.0 ** level for level in xrange(9)))
+
+    def test_simulator(self):
+        profiler = simulate.Profiler()
+        evolution = simulate.BlockTimestepGravityEvolution(t=2, diagnostics=True)
+        simulator = simulate.Simulator([evolution], [], self.get_encounter_universe(), simulate.FirstOf([simulate.Iterations(20), simulate.EnergyDrift(1e-3)]), simulate.Headless(), profiler=profiler)
+        simulator.run()
+        self.assertEqual(20, len(profiler.stats))
+        self.assertEqual(9, len(profiler.stats.records[-1]['levels']))
+        self.assertTrue('energy' in profiler.stats.records[-1])
+
+class CompiledGravityEvolutionTest(TestCase):
+
+    def test_matches_vectorized(self):
+        seed(6)
+        points = simulate.Universe.random(100).points
+        expected = simulate.ArrayUniverse(points)
+        simulate.VectorizedGravityEvolution().evolve(expected)
+        for evolution, places in ((simulate.CompiledGravityEvolution(), 7), (simulate.CompiledGravityEvolution(parallel=False), 7), (simulate.CompiledGravityEvolution(dtype='float32'), 2)):
+            actual = simulate.ArrayUniverse(points)
+            evolution.evolve(actual)
+            self.assertEqual(actual.positions.dtype, np.float64)
+            for value, expected_value in zip(actual.velocities.ravel().tolist(), expected.velocities.ravel().tolist()):
+                self.assertAlmostEqual(expected_value, value, places)
+
+    def test_compiled_merge_collision(self):
+        seed(4)
+        points = simulate.Universe.random(300).points
+        universes = [simulate.ArrayUniverse(points), simulate.ArrayUniverse(points)]
+        simulate.MergeCollision().resolve(universes[0])
+        simulate.MergeCollision(compiled=True).resolve(universes[1])
+        self.assertEqual(str(universes[0]), str(universes[1]))
+
+    def test_compiled_merge_chains(self):
+        # Survivors grow and merge again, with points the sweep did not pair
+        # them with.
+        for universe_class in (simulate.Universe, simulate.ArrayUniverse):
+            universes = []
+            for i in xrange(2):
+                seed(5)
+                universes.append(universe_class.static_identical_planets(200))
+            simulate.MergeCollision().resolve(universes[0])
+            simulate.MergeCollision(compiled=True).resolve(universes[1])
+            self.assertTrue(len(universes[0].points) < 200)
+            self.assertEqual(str(universes[0]), str(universes[1]))
+
+    @skipIf(not environ.get('REQUIRE_NUMBA'), "Numba is not required")
+    def test_numba_required(self):
+        self.assertTrue(simulate.NUMBA_AVAILABLE)
+
+    @skipIf(not simulate.NUMBA_AVAILABLE, "Numba is not installed")
+    def test_overlapping_pairs(self):
+        xs = 10.0 * np.arange(100)
+        ys = np.zeros(100)
+        radii = np.repeat(4.0, 100)
+        first, second, tested = simulate.MergeCollision.overlapping_pairs(xs, ys, radii)
+        self.assertEqual(([], [], 0), (first.tolist(), second.tolist(), tested))
+        xs[50] = 495
+        first, second, tested = simulate.MergeCollision.overlapping_pairs(xs, ys, radii)
+        self.assertEqual(([49], [50]), (first.tolist(), second.tolist()))
+
+class ParallelGravityEvolutionTest(TestCase):
+
+    def test_matches_vectorized(self):
+        seed(6)
+        points = simulate.Universe.random(100).points
+        expected = simulate.ArrayUniverse(points)
+        actual = simulate.ArrayUniverse(points)
+        evolution = simulate.ParallelGravityEvolution(processes=3, tile_size=16)
+        try:
+            for i in xrange(3):
+                simulate.VectorizedGravityEvolution(tile_size=16).evolve(expected)
+                evolution.evolve(actual)
+                self.assertEqual(expected.positions.tolist(), actual.positions.tolist())
+                self.assertEqual(expected.velocities.tolist(), actual.velocities.tolist())
+            # Growing past the capacity of the shared arrays restarts the pool.
+            actual.points = actual.points + simulate.Universe.random(50).points
+            evolution.evolve(actual)
+            self.assertEqual(200, evolution._capacity)
+        finally:
+            evolution.close()
+
+    def test_closed_by_simulator(self):
+        class FailingEvolution(object):
+            def evolve(self, universe):
+                raise RuntimeError("step failed")
+        evolution = simulate.ParallelGravityEvolution(processes=2)
+        simulator = simulate.Simulator([evolution, FailingEvolution()], [], simulate.ArrayUniverse.random(20), simulate.Iterations(5), simulate.Headless())
+        with self.assertRaises(RuntimeError):
+            simulator.run()
+        self.assertTrue(evolution._pool is None)
+
+class TiledGravityEvolutionTest(TestCase):
+
+    def test_matches_vectorized(self):
+        seed(8)
+        points = simulate.Universe.random(300).points
+        expected = simulate.ArrayUniverse(points)
+        simulate.VectorizedGravityEvolution().evolve(expected)
+        for tiles, tolerance in ((1, 1e-9), (4, 0.05)):
+            actual = simulate.ArrayUniverse(points)
+            evolution = simulate.TiledGravityEvolution(tiles=tiles, processes=2)
+            try:
+                evolution.evolve(actual)
+            finally:
+                evolution.close()
+            error = np.abs(actual.velocities - expected.velocities).max()
+            self.assertTrue(error < tolerance * np.abs(expected.velocities).max())
+            if tiles > 1:
+                self.assertTrue(evolution.interactions < 300 * 299)
+
+    def test_closed_by_simulator(self):
+        seed(8)
+        evolution = simulate.TiledGravityEvolution(processes=2)
+        collision = simulate.TiledMergeCollision(processes=2)
+        simulate.Simulator([evolution], [collision], simulate.ArrayUniverse.random(50), simulate.Iterations(2), simulate.Headless()).run()
+        self.assertTrue(evolution._pool is None)
+        self.assertTrue(collision._pool is None)
+
+class BarnesHutGravityEvolutionTest(TestCase):
+
+    def test_evolution(self):
+        universe = Factory.get_evolve_universe()
+        evolution = simulate.BarnesHutGravityEvolution()
+        evolution.evolve(universe)
+        self.assertAlmostEqual(3.9375, (universe.points[0].position - universe.points[1].position).length)
+        evolution.evolve(universe)
+        self.assertAlmostEqual(3.748, (universe.points[0].position - universe.points[1].position).length, 3)
+
+    def test_approximation(self):
+        seed(2)
+        points = simulate.Universe.random(200).points
+        exact = simulate.ArrayUniverse(points)
+        exact_zero_theta = simulate.ArrayUniverse(points)
+        approximate = simulate.ArrayUniverse(points)
+        simulate.VectorizedGravityEvolution().evolve(exact)
+        simulate.BarnesHutGravityEvolution(theta=0).evolve(exact_zero_theta)
+        simulate.BarnesHutGravityEvolution(theta=0.5).evolve(approximate)
+        self.assertTrue(abs(exact.positions - exact_zero_theta.positions).max() < 1e-9)
+        self.assertTrue(abs(exact.positions - approximate.positions).max() < 0.1)
+
+    def test_refit(self):
+        seed(3)
+        universe = simulate.ArrayUniverse.static_identical_planets(100)
+        evolution = simulate.BarnesHutGravityEvolution(t=0.01)
+        evolution.evolve(universe)
+        tree = evolution._tree
+        evolution.evolve(universe)
+        self.assertTrue(tree is evolution._tree)
+        universe.remove(universe.points[0])
+        evolution.evolve(universe)
+        self.assertFalse(tree is evolution._tree)
+
+    def test_refit_moves_bodies(self):
+        random_state = np.random.RandomState(4)
+        positions = random_state.uniform(0, 100, (300, 2))
+        masses = random_state.uniform(1, 10, 300)
+        tree = simulate.QuadTree(positions, masses, leaf_size=4)
+        moved = positions + random_state.normal(0, 1, positions.shape)
+        moved = np.clip(moved, tree.box[0], tree.box[0] + tree.box[2] - 1e-9)
+        self.assertTrue(tree.refit(moved, masses))
+        rebuilt = simulate.QuadTree(moved, masses, leaf_size=4, box=tree.box)
+        self.assertEqual(rebuilt.accelerations(0.5)[0].tolist(), tree.accelerations(0.5)[0].tolist())
+        self.assertFalse(tree.refit(moved + 1000, masses))
+        exact = simulate.VectorizedGravityEvolution.compute_gravity_accelerations(moved, masses)
+        self.assertTrue(np.allclose(exact, tree.accelerations(0)[0], rtol=1e-9, atol=1e-12))
+
+    def test_resume(self):
+        directory = mkdtemp()
+        seed(6)
+        universe = simulate.ArrayUniverse.random(60)
+        universe.positions[...] += [[random(), random()] for point in universe.points]
+        expected = simulate.Simulator([simulate.BarnesHutGravityEvolution(leaf_size=4)], [simulate.MergeCollision()], universe, simulate.Iterations(20), simulate.Headless(), checkpointer=simulate.Checkpointer(directory, every=10))
+        expected.run()
+        actual = simulate.Simulator.resume(join(directory, 'checkpoint-%012d.gsim' % 10))
+        self.assertEqual(expected.universe.positions.tolist(), actual.universe.positions.tolist())
+        rmtree(directory)
+
+def build_failing_member(parameters):
+    if parameters['n'] == 100:
+        raise ValueError("failed member")
+    sleep(2)
+    return simulate.Ensemble.build(parameters)
+
+class EnsembleTest(TestCase):
+
+    def test_run(self):
+        ensemble = simulate.Ensemble({'n': [5, 8], 'seed': [1, 2], 'iterations': [5]}, processes=2)
+        rows = ensemble.run()
+        self.assertEqual(4, len(rows))
+        self.assertEqual([(5, 1), (5, 2), (8, 1), (8, 2)], [(row['n'], row['seed']) for row in rows])
+        for row in rows:
+            self.assertTrue(0 < row['bodies'] <= row['n'])
+            self.assertTrue(row['stars'] <= row['bodies'])
+        again = simulate.Ensemble.run_member(ensemble.parameters()[3])
+        self.assertEqual(rows[3]['bodies'], again['bodies'])
+        self.assertEqual(rows[3]['energy'], again['energy'])
+        file_name = 'ensemble.csv'
+        simulate.Ensemble.to_csv(rows, file_name)
+        self.assertEqual(5, len(open(file_name).readlines()))
+        remove(file_name)
+
+    def test_failed_member_stops_pool(self):
+        ensemble = simulate.Ensemble({'n': [2, 100], 'seed': range(10), 'iterations': [1]}, processes=2, build=build_failing_member)
+        started = time()
+        with self.assertRaises(ValueError):
+            ensemble.run()
+        self.assertTrue(time() - started < 5)
+
+class TrajectoryRecorderTest(TestCase):
+
+    def test_record_and_replay(self):
+        file_name = 'trajectory.bin'
+        recorder = simulate.TrajectoryRecorder(file_name, chunk_steps=4)
+        universe = Factory.get_simple_universe()
+        simulator = simulate.Simulator([simulate.VectorizedGravityEvolution()], [simulate.MergeCollision()], universe, simulate.Iterations(10), simulate.Headless(), [recorder])
+        simulator.run()
+        replay = simulate.Replay(file_name)
+        self.assertEqual(range(1, 11), replay.steps.tolist())
+        last = replay.state(10)
+        self.assertEqual(2, last.count)
+        self.assertEqual([[point.position.x, point.position.y] for point in universe.points], last.positions.tolist())
+        self.assertEqual([point.radius for point in universe.points], last.radii.tolist())
+        with self.assertRaises(KeyError):
+            replay.state(11)
+        replay.play(stop=3)
+        del replay, last
+        remove(file_name)
+        remove(simulate.TrajectoryRecorder.index_filename(file_name))
+
+    def record(self, file_name, iterations, **kwargs):
+        recorder = simulate.TrajectoryRecorder(file_name, chunk_steps=4, **kwargs)
+        simulator = simulate.Simulator([simulate.VectorizedGravityEvolution()], [], Factory.get_orbit_universe(), simulate.Iterations(iterations), simulate.Headless(), [recorder])
+        simulator.run()
+        return simulator
+
+    def test_new_recording_truncates(self):
+        file_name = 'trajectory.bin'
+        self.record(file_name, 10)
+        simulator = self.record(file_name, 5)
+        replay = simulate.Replay(file_name)
+        self.assertEqual(range(1, 6), replay.steps.tolist())
+        self.assertEqual([[point.position.x, point.position.y] for point in simulator.universe.points], replay.state(5).positions.tolist())
+        del replay
+        remove(file_name)
+        remove(simulate.TrajectoryRecorder.index_filename(file_name))
+
+    def test_append(self):
+        file_name = 'trajectory.bin'
+        self.record(file_name, 10)
+        recorder = simulate.TrajectoryRecorder(file_name, chunk_steps=4, append=True)
+        universe = Factory.get_orbit_universe()
+        for iteration in range(7, 9):
+            recorder.observe(iteration, universe)
+        recorder.close()
+        replay = simulate.Replay(file_name)
+        self.assertEqual(range(1, 9), replay.steps.tolist())
+        self.assertEqual([[point.position.x, point.position.y] for point in universe.points], replay.state(8).positions.tolist())
+        del replay
+        remove(file_name)
+        remove(simulate.TrajectoryRecorder.index_filename(file_name))
+
+    def test_unsorted_index(self):
+        file_name = 'trajectory.bin'
+        self.record(file_name, 3)
+        index_file_name = simulate.TrajectoryRecorder.index_filename(file_name)
+        index = np.fromfile(index_file_name, dtype='<i8').reshape(-1, 3)
+        index[[0, 1]] = index[[1, 0]]
+        index.tofile(index_file_name)
+        with self.assertRaises(ValueError):
+            simulate.Replay(file_name)
+        remove(file_name)
+        remove(index_file_name)
+
+class FrameExporterTest(TestCase):
+
+    def get_simulator(self, exporter):
+        return simulate.Simulator([simulate.VectorizedGravityEvolution()], [simulate.MergeCollision()], simulate.Universe.star_planet_system(), simulate.Iterations(6), simulate.Headless(), [exporter])
+
+    def test_rgb_stream(self):
+        file_name = 'frames.rgb'
+        simulator = self.get_simulator(simulate.FrameExporter(file_name, every=2, format=simulate.FrameExporter.RGB, batch_size=2))
+        simulator.run()
+        size = simulate.Universe.SIZE
+        frames = np.fromfile(file_name, dtype=np.uint8).reshape(-1, size, size, 3)
+        self.assertEqual(3, len(frames))
+        self.assertTrue((simulator.universe.frame().to_array() == frames[-1]).all())
+        remove(file_name)
+
+    def test_png_sequence(self):
+        directory = mkdtemp()
+        exporter = simulate.FrameExporter(join(directory, '%03d.png'))
+        self.get_simulator(exporter).run()
+        self.assertEqual(6, exporter.written)
+        self.assertEqual(['%03d.png' % i for i in xrange(6)], sorted(listdir(directory)))
+        rmtree(directory)
+
+    def test_format(self):
+        with self.assertRaises(ValueError):
+            simulate.FrameExporter('frames.mp4', format='mp4')
+
+class CheckpointerTest(TestCase):
+
+    def get_simulator(self, checkpointer):
+        seed(9)
+        universe = simulate.ArrayUniverse.random(100)
+        termination = simulate.FirstOf([simulate.Iterations(20), simulate.EnergyDrift(10.0)])
+        return simulate.Simulator([simulate.LeapfrogGravityEvolution(diagnostics=True)], [simulate.MergeCollision(), simulate.StarFormation()], universe, termination, simulate.Headless(), checkpointer=checkpointer)
+
+    def test_resume(self):
+        directory = mkdtemp()
+        expected = self.get_simulator(simulate.Checkpointer(directory, every=5, keep=2))
+        expected.run()
+        expected_draw = random()
+        self.assertEqual(['checkpoint-%012d.gsim' % i for i in (15, 20)], sorted(listdir(directory)))
+        seed(0)
+        actual = simulate.Simulator.resume(join(directory, 'checkpoint-%012d.gsim' % 15))
+        self.assertEqual(20, actual.iteration)
+        self.assertEqual(expected.universe.positions.tolist(), actual.universe.positions.tolist())
+        self.assertEqual(expected.universe.velocities.tolist(), actual.universe.velocities.tolist())
+        self.assertEqual(str(expected.universe), str(actual.universe))
+        self.assertEqual(expected._termination_condition._conditions[1].drift, actual._termination_condition._conditions[1].drift)
+        # The random generators continue where the checkpoint left them.
+        self.assertEqual(expected_draw, random())
+        rmtree(directory)
+
+    def test_resume_block_timesteps(self):
+        # The levels depend on the cached jerks, which the universe alone
+        # does not determine.
+        directory = mkdtemp()
+        seed(4)
+        universe = simulate.ArrayUniverse.random(40)
+        universe.positions[...] += [[random(), random()] for point in universe.points]
+        expected = simulate.Simulator([simulate.BlockTimestepGravityEvolution(eta=0.05)], [], universe, simulate.Iterations(20), simulate.Headless(), checkpointer=simulate.Checkpointer(directory, every=10))
+        expected.run()
+        actual = simulate.Simulator.resume(join(directory, 'checkpoint-%012d.gsim' % 10))
+        self.assertEqual(expected.universe.positions.tolist(), actual.universe.positions.tolist())
+        self.assertEqual(expected.universe.velocities.tolist(), actual.universe.velocities.tolist())
+        rmtree(directory)
+
+    def test_seconds(self):
+        directory = mkdtemp()
+        checkpointer = simulate.Checkpointer(directory, seconds=0, keep=3)
+        self.get_simulator(checkpointer).run()
+        self.assertEqual(20, len(checkpointer.written))
+        self.assertEqual(join(directory, 'checkpoint-%012d.gsim' % 20), simulate.Checkpointer.latest(directory))
+        self.assertEqual(3, len(simulate.Checkpointer.checkpoints(directory)))
+        rmtree(directory)
+
+    def test_schedule(self):
+        with self.assertRaises(ValueError):
+            simulate.Checkpointer('checkpoints')
+        with self.assertRaises(ValueError):
+            simulate.Checkpointer('checkpoints', every=1, keep=0)
+
+    def test_closed_on_error(self):
+        directory = mkdtemp()
+        file_name = join(directory, 'trajectory.bin')
+        class FailingEvolution(object):
+            steps = 0
+            def evolve(self, universe):
+                if self.steps == 3:
+                    raise RuntimeError("step failed")
+                self.steps += 1
+        checkpointer = simulate.Checkpointer(directory, every=2)
+        simulator = simulate.Simulator([FailingEvolution()], [], Factory.get_simple_universe(), simulate.Iterations(10), simulate.Headless(), [simulate.TrajectoryRecorder(file_name)], checkpointer=checkpointer)
+        with self.assertRaises(RuntimeError):
+            simulator.run()
+        self.assertEqual([1, 2, 3], simulate.Replay(file_name).steps.tolist())
+        self.assertEqual(join(directory, 'checkpoint-%012d.gsim' % 2), simulate.Checkpointer.latest(directory))
+        rmtree(directory)
+
+    def test_keep_one(self):
+        directory = mkdtemp()
+        self.get_simulator(simulate.Checkpointer(directory, every=1, keep=1)).run()
+        self.assertEqual(['checkpoint-%012d.gsim' % 20], listdir(directory))
+        rmtree(directory)
+
+class ParticleMeshGravityEvolutionTest(TestCase):
+
+    def test_far_field(self):
+        positions = np.array([[100.0, 100.0], [400.0, 500.0], [420.0, 480.0], [-300.0, 900.0]])
+        masses = np.array([5.0, 100.0, 50.0, 20.0])
+        exact = simulate.VectorizedGravityEvolution.compute_gravity_accelerations(positions, masses)
+        approximate = simulate.ParticleMeshGravityEvolution(short_range=False).compute_gravity_accelerations(positions, masses)
+        self.assertTrue(np.allclose(exact[0], approximate[0], rtol=1e-3))
+
+    def test_short_range(self):
+        random_state = np.random.RandomState(7)
+        positions = random_state.uniform(0, simulate.Universe.SIZE, (500, 2))
+        masses = random_state.uniform(1, 10, 500)
+        exact = simulate.VectorizedGravityEvolution.compute_gravity_accelerations(positions, masses)
+        evolution = simulate.ParticleMeshGravityEvolution(grid_size=64, short_range=True)
+        approximate = evolution.compute_gravity_accelerations(positions, masses)
+        error = np.linalg.norm(approximate - exact, axis=1) / np.linalg.norm(exact, axis=1)
+        self.assertTrue(np.median(error) < 0.05)
+        self.assertTrue(evolution.interactions > 0)
+
+    def test_evolution(self):
+        universe = simulate.ArrayUniverse(Factory.get_evolve_universe().points)
+        simulate.ParticleMeshGravityEvolution().evolve(universe)
+        self.assertAlmostEqual(3.9375, (universe.points[0].position - universe.points[1].position).length, 2)
+
+    def test_erfc(self):
+        x = np.linspace(-3, 8, 1001)
+        expected = np.array([erfc(value) for value in x])
+        self.assertTrue(np.allclose(expected, simulate.ParticleMeshGravityEvolution.erfc(x), rtol=2e-7, atol=0))
+
+class SpatialHashTest(TestCase):
+
+    def test_pairs_within(self):
+        random_state = np.random.RandomState(8)
+        positions = random_state.uniform(0, 100, (200, 2))
+        i, j = simulate.SpatialHash.pairs_within(positions, 10.0)
+        distances = np.linalg.norm(positions[:, np.newaxis] - positions[np.newaxis], axis=2)
+        expected = set(zip(*np.nonzero(distances < 10.0))) - set((k, k) for k in xrange(200))
+        self.assertEqual(expected, set(zip(i.tolist(), j.tolist())))
+        chunks = list(simulate.SpatialHash.pair_chunks(positions, 10.0, chunk_size=100))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(len(i), sum(len(chunk_i) for chunk_i, _ in chunks))
+        self.assertEqual(expected, set((a, b) for chunk_i, chunk_j in chunks for a, b in zip(chunk_i.tolist(), chunk_j.tolist())))
+
 class SimulatorTest(TestCase):
 
     def test_run_simulation(self):
         with self.assertRaises(SystemExit) as cm:
             Factory.get_simulator().run()
         self.assertEqual(cm.exception.code, 0)
+
+    def test_headless(self):
+        simulator = simulate.Simulator([simulate.VectorizedGravityEvolution()], [simulate.MergeCollision()], simulate.Universe.star_planet_system(), simulate.Iterations(10), simulate.Headless())
+        simulator.run()
+        self.assertEqual(10, simulator._iteration)
+
+    def test_profiler(self):
+        file_name = 'summary.jsonl'
+        profiler = simulate.Profiler(file_name, summary_every=4)
+        simulator = simulate.Simulator([simulate.VectorizedGravityEvolution()], [simulate.MergeCollision(), simulate.StarFormation()], Factory.get_simple_universe(), simulate.Iterations(10), simulate.Headless(), profiler=profiler)
+        simulator.run()
+        stats = profiler.stats
+        self.assertEqual(10, len(stats))
+        self.assertEqual(['MergeCollision', 'StarFormation', 'VectorizedGravityEvolution'], sorted(stats.phase_seconds()))
+        self.assertEqual(1, stats.records[0]['merges'])
+        self.assertEqual(2, stats.records[-1]['bodies'])
+        # 3 bodies in the first iteration and 2 in the others, plus collision tests.
+        self.assertTrue(stats.summary()['interactions'] >= 6 + 9 * 2)
+        summaries = [loads(line) for line in open(file_name)]
+        self.assertEqual([4, 8, 10], [summary['iterations'] for summary in summaries])
+        self.assertEqual(1, summaries[-1]['merges'])
+        remove(file_name)
+
+class RenderCadenceTest(TestCase):
+
+    def test_every(self):
+        cadence = simulate.RenderCadence(every=3)
+        self.assertEqual([3, 6, 9], [i for i in xrange(1, 11) if cadence.should_render(i)])
+
+    def test_max_fps(self):
+        cadence = simulate.RenderCadence(max_fps=1e-3)
+        self.assertTrue(cadence.should_render(1))
+        self.assertFalse(cadence.should_render(2))
+
+class SpriteRendererTest(TestCase):
+
+    def test_matches_frame_render(self):
+        seed(3)
+        frame = simulate.Universe.random(50).frame()
+        expected = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        frame.render(expected)
+        actual = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        renderer = simulate.SpriteRenderer()
+        self.assertEqual([actual.get_rect()], renderer.draw(actual, frame)[:1])
+        self.assertTrue((surfarray.array3d(expected) == surfarray.array3d(actual)).all())
+
+    def test_dirty_rects(self):
+        surface = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        renderer = simulate.SpriteRenderer()
+        renderer.draw(surface, simulate.Frame(((100, 100),), (5,), (False,)))
+        frame = simulate.Frame(((200, 100),), (5,), (True,))
+        changed = renderer.draw(surface, frame)
+        self.assertEqual(2, len(changed))
+        self.assertTrue(changed[0].collidepoint(100, 100) and changed[1].collidepoint(200, 100))
+        expected = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        frame.render(expected)
+        self.assertTrue((surfarray.array3d(expected) == surfarray.array3d(surface)).all())
+
+    def test_unchanged_frame(self):
+        seed(4)
+        frame = simulate.Universe.random(50).frame()
+        surface = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        renderer = simulate.SpriteRenderer()
+        renderer.draw(surface, frame)
+        self.assertEqual([], renderer.draw(surface, frame))
+        self.assertEqual([], renderer.draw(surface, unpickle(dumps(frame, 0))))
+
+    def test_partial_redraw(self):
+        seed(5)
+        universe = simulate.Universe.random(50)
+        surface = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        renderer = simulate.SpriteRenderer()
+        renderer.draw(surface, universe.frame())
+        moved = universe.points[7]
+        old = universe.frame()
+        moved.position = simulate.Vector2D(moved.position.x + 3, moved.position.y + 2)
+        frame = universe.frame()
+        changed = renderer.draw(surface, frame)
+        self.assertEqual([renderer._rect(key) for key in (zip(old.positions, old.radii, old.stars)[7], zip(frame.positions, frame.radii, frame.stars)[7])], changed)
+        expected = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        frame.render(expected)
+        self.assertTrue((surfarray.array3d(expected) == surfarray.array3d(surface)).all())
+
+    def test_density(self):
+        surface = Surface((simulate.Universe.SIZE, simulate.Universe.SIZE))
+        renderer = simulate.SpriteRenderer(density_threshold=2)
+        frame = simulate.Frame(((10, 20), (10, 20), (30, 40)), (1, 1, 1), (False, False, False))
+        self.assertEqual([surface.get_rect()], renderer.draw(surface, frame))
+        self.assertEqual((255, 255, 255), tuple(surface.get_at((10, 20)))[:3])
+        self.assertTrue(0 < surface.get_at((30, 40))[0] < 255)
+        self.assertEqual((0, 0, 0), tuple(surface.get_at((20, 20)))[:3])
+
+class ThreadedRendererTest(TestCase):
+
+    def test_frame(self):
+        frame = Factory.get_simple_universe().frame()
+        self.assertEqual(((1, 1), (2, 2), (20, 20)), frame.positions)
+        self.assertEqual((5, 5, 5), frame.radii)
+        self.assertEqual(frame.positions, simulate.ArrayUniverse(Factory.get_simple_universe().points).frame().positions)
+
+    def test_drops_frames(self):
+        # The renderer thread draws at most one frame per second, so nearly
+        # all of the frames are dropped, and every frame is counted once.
+        renderer = simulate.ThreadedRenderer(fps=1, queue_size=2)
+        universe = Factory.get_simple_universe()
+        for i in xrange(50):
+            universe.points[0].position = simulate.Vector2D(i, 0)
+            renderer.render(universe)
+        with self.assertRaises(SystemExit):
+            renderer.close(universe)
+        self.assertEqual(50, renderer.rendered + renderer.dropped)
+        self.assertTrue(renderer.rendered <= 3)
+
+    def test_run_simulation(self):
+        renderer = simulate.ThreadedRenderer(fps=1000)
+        simulator = simulate.Simulator([simulate.VectorizedGravityEvolution()], [simulate.MergeCollision()], simulate.Universe.star_planet_system(), simulate.Iterations(20), renderer)
+        with self.assertRaises(SystemExit) as cm:
+            simulator.run()
+        self.assertEqual(cm.exception.code, 0)
+        self.assertTrue(renderer.rendered > 0)
+        self.assertEqual(20, renderer.rendered + renderer.dropped + renderer._queue.qsize())
         
+class BenchmarkTest(TestCase):
+
+    def test_fit_exponent(self):
+        self.assertAlmostEqual(2.0, benchmark.Benchmarks.fit_exponent([10, 100, 1000], [1e-4, 1e-2, 1.0]))
+        self.assertEqual(None, benchmark.Benchmarks.fit_exponent([10], [1.0]))
+
+    def test_regressions(self):
+        baseline = {'a': {'sizes': [10, 100], 'seconds': [1.0, 2.0]}}
+        results = {'a': {'sizes': [10, 100], 'seconds': [1.2, 3.0]}, 'b': {'sizes': [10], 'seconds': [5.0]}}
+        self.assertEqual([('a', 100, 3.0, 2.0)], benchmark.Benchmarks.regressions(results, baseline, 0.25))
+
+    def test_run(self):
+        benchmarks = [b for b in benchmark.Benchmarks.all() if b.name in ('StarFormation.resolve', 'Simulator.run')]
+        results = benchmark.Benchmarks.run(benchmarks, benchmark.Benchmarks.SIZES, repeat=1, max_size=100)
+        self.assertEqual([10, 100], results['Simulator.run']['sizes'])
+        self.assertEqual(2, len(results['StarFormation.resolve']['seconds']))
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file